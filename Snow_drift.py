@@ -31,6 +31,8 @@ Assumptions:
        - Solid: 2.9
 """
 
+import sys
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -43,16 +45,21 @@ def compute_Qupot(hourly_wind_speeds, dt=3600):
     Formula:
        Qupot = sum((u^3.8) * dt) / 233847
     """
-    total = sum((u ** 3.8) * dt for u in hourly_wind_speeds) / 233847
+    u = np.asarray(hourly_wind_speeds, dtype=float)
+    total = np.sum(np.power(u, 3.8) * dt) / 233847
     return total
 
 def sector_index(direction):
     """
     Given a wind direction in degrees, returns the index (0-15)
     corresponding to a 16-sector division.
+    Accepts a scalar or an array of directions.
     """
     # Center the bin by adding 11.25° then modulo 360 and divide by 22.5°
-    return int(((direction + 11.25) % 360) // 22.5)
+    idx = ((np.asarray(direction, dtype=float) + 11.25) % 360) // 22.5
+    if idx.ndim == 0:
+        return int(idx)
+    return idx.astype(int)
 
 def compute_sector_transport(hourly_wind_speeds, hourly_wind_dirs, dt=3600):
     """
@@ -66,11 +73,10 @@ def compute_sector_transport(hourly_wind_speeds, hourly_wind_dirs, dt=3600):
     Returns:
       A list of 16 transport values (kg/m) corresponding to the sectors.
     """
-    sectors = [0.0] * 16
-    for u, d in zip(hourly_wind_speeds, hourly_wind_dirs):
-        idx = sector_index(d)
-        sectors[idx] += ((u ** 3.8) * dt) / 233847
-    return sectors
+    u = np.asarray(hourly_wind_speeds, dtype=float)
+    idx = np.atleast_1d(sector_index(hourly_wind_dirs))
+    sectors = np.bincount(idx, weights=(np.power(u, 3.8) * dt) / 233847, minlength=16)
+    return sectors.tolist()
 
 def compute_snow_transport(T, F, theta, Swe, hourly_wind_speeds, dt=3600):
     """
@@ -115,6 +121,65 @@ def compute_snow_transport(T, F, theta, Swe, hourly_wind_speeds, dt=3600):
         "Control": control
     }
 
+def assign_season(df):
+    """
+    Add a 'season' column to the DataFrame.
+    If month >= 7, season = current year; otherwise, season = previous year.
+    """
+    time = df['time'].dt
+    df['season'] = np.where(time.month >= 7, time.year, time.year - 1)
+    return df
+
+def compute_seasonal_transport(df, T, F, theta, dt=3600):
+    """
+    Vectorized engine computing Qupot, Swe, the 16-sector breakdown and Qt
+    for every season in a single pass over the hourly data.
+
+    The DataFrame must contain a 'season' column (see assign_season) and the
+    hourly temperature, precipitation, wind speed and wind direction columns.
+
+    Returns:
+      yearly_df: DataFrame with one row per season, same columns as
+                 compute_yearly_results.
+      sectors_df: DataFrame indexed by season with the 16 sector transports (kg/m).
+    """
+    seasons, inv = np.unique(df['season'].to_numpy(), return_inverse=True)
+    n = len(seasons)
+
+    temp = df['temperature_2m (°C)'].to_numpy(dtype=float)
+    precip = df['precipitation (mm)'].to_numpy(dtype=float)
+    ws = df["wind_speed_10m (m/s)"].to_numpy(dtype=float)
+    wdir = df["wind_direction_10m (°)"].to_numpy(dtype=float)
+
+    # Hourly Swe: precipitation counts when temperature < +1°C.
+    # Missing precipitation hours count as zero, like the pandas sum skipping NaN.
+    swe_hourly = np.where(temp < 1, np.nan_to_num(precip), 0.0)
+    transport = np.power(ws, 3.8) * dt
+
+    Swe = np.bincount(inv, weights=swe_hourly, minlength=n)
+    Qupot = np.bincount(inv, weights=transport, minlength=n) / 233847
+    sectors = np.bincount(
+        inv * 16 + sector_index(wdir), weights=transport / 233847, minlength=n * 16
+    ).reshape(n, 16)
+
+    Qspot = 0.5 * T * Swe
+    Srwe = theta * Swe
+    snowfall_controlled = Qupot > Qspot
+    Qinf = np.where(snowfall_controlled, 0.5 * T * Srwe, Qupot)
+    Qt = Qinf * (1 - 0.14 ** (F / T))
+
+    yearly_df = pd.DataFrame({
+        "Qupot (kg/m)": Qupot,
+        "Qspot (kg/m)": Qspot,
+        "Srwe (mm)": Srwe,
+        "Qinf (kg/m)": Qinf,
+        "Qt (kg/m)": Qt,
+        "Control": np.where(snowfall_controlled, "Snowfall controlled", "Wind controlled"),
+        "season": [f"{s}-{s+1}" for s in seasons],
+    })
+    sectors_df = pd.DataFrame(sectors, index=pd.Index(seasons, name="season"))
+    return yearly_df, sectors_df
+
 def compute_yearly_results(df, T, F, theta):
     """
     Compute the yearly (seasonal) snow transport parameters for every season in the data.
@@ -122,24 +187,8 @@ def compute_yearly_results(df, T, F, theta):
     
     Returns a DataFrame with one row per season.
     """
-    seasons = sorted(df['season'].unique())
-    results_list = []
-    for s in seasons:
-        season_start = pd.Timestamp(year=s, month=7, day=1)
-        season_end = pd.Timestamp(year=s+1, month=6, day=30, hour=23, minute=59, second=59)
-        df_season = df[(df['time'] >= season_start) & (df['time'] <= season_end)]
-        if df_season.empty:
-            continue
-        # Calculate hourly Swe: precipitation counts when temperature < +1°C.
-        df_season = df_season.copy()  # avoid SettingWithCopyWarning
-        df_season['Swe_hourly'] = df_season.apply(
-            lambda row: row['precipitation (mm)'] if row['temperature_2m (°C)'] < 1 else 0, axis=1)
-        total_Swe = df_season['Swe_hourly'].sum()
-        wind_speeds = df_season["wind_speed_10m (m/s)"].tolist()
-        result = compute_snow_transport(T, F, theta, total_Swe, wind_speeds)
-        result["season"] = f"{s}-{s+1}"
-        results_list.append(result)
-    return pd.DataFrame(results_list)
+    yearly_df, _ = compute_seasonal_transport(df, T, F, theta)
+    return yearly_df
 
 def compute_average_sector(df):
     """
@@ -147,17 +196,9 @@ def compute_average_sector(df):
     The function groups the data by season and computes the sector contributions
     for each season, then returns the mean across seasons.
     """
-    sectors_list = []
-    for s, group in df.groupby('season'):
-        group = group.copy()
-        group['Swe_hourly'] = group.apply(
-            lambda row: row['precipitation (mm)'] if row['temperature_2m (°C)'] < 1 else 0, axis=1)
-        ws = group["wind_speed_10m (m/s)"].tolist()
-        wdir = group["wind_direction_10m (°)"].tolist()
-        sectors = compute_sector_transport(ws, wdir)
-        sectors_list.append(sectors)
-    avg_sectors = np.mean(sectors_list, axis=0)
-    return avg_sectors
+    # The sector breakdown does not depend on T, F or theta.
+    _, sectors_df = compute_seasonal_transport(df, T=1, F=1, theta=1)
+    return sectors_df.to_numpy().mean(axis=0)
 
 
 def plot_rose(avg_sector_values, overall_avg):
@@ -231,6 +272,155 @@ def compute_fence_height(Qt, fence_type):
     H = (Qt_tonnes / factor) ** (1 / 2.2)
     return H
 
+FENCE_TYPES = ["Wyoming", "Slat-and-wire", "Solid"]
+
+def site_results(df, lat, lon, T=3000, F=30000, theta=0.5):
+    """
+    Seasonal results of one site from its hourly DataFrame: one row per
+    season with Qt and the necessary fence height for every fence type.
+    """
+    assign_season(df)
+    yearly_df, _ = compute_seasonal_transport(df, T, F, theta)
+
+    result = yearly_df[["season", "Qt (kg/m)", "Control"]].copy()
+    for ft in FENCE_TYPES:
+        result[f"{ft} (m)"] = compute_fence_height(result["Qt (kg/m)"].to_numpy(), ft)
+    result.insert(0, "lon", lon)
+    result.insert(0, "lat", lat)
+    return result
+
+def compute_site_results(lat, lon, start_date, end_date, T=3000, F=30000, theta=0.5, loader=None):
+    """
+    Fetch (or load) hourly data for one site and compute its seasonal results.
+
+    Parameters:
+      lat, lon: coordinate of the site (degrees)
+      start_date, end_date: date range as 'YYYY-MM-DD' strings
+      T, F, theta: snow transport parameters (see compute_snow_transport)
+      loader: callable(lat, lon, start_date, end_date) returning an hourly
+              DataFrame. Defaults to utils.fetch_meteo (Open-Meteo ERA5).
+
+    Returns a DataFrame with one row per season, including Qt and the
+    necessary fence height for every fence type.
+    """
+    if loader is None:
+        from utils import fetch_meteo
+        loader = fetch_meteo
+
+    return site_results(loader(lat, lon, start_date, end_date), lat, lon, T, F, theta)
+
+def compute_batch_results(points, start_date, end_date, T=3000, F=30000, theta=0.5,
+                          loader=None, max_workers=None, download_workers=4):
+    """
+    Compute seasonal snow drift results for many sites.
+
+    The hourly data is loaded by a thread pool of `download_workers`, so at
+    most that many requests go to Open-Meteo at a time, and duplicate sites
+    are downloaded only once. Each loaded site is handed to a process
+    pool of `max_workers` (defaults to the CPU count) for the computation.
+
+    Parameters:
+      points: DataFrame with 'lat' and 'lon' columns, or an iterable of (lat, lon)
+      The remaining parameters are passed on to compute_site_results.
+
+    Returns one tidy DataFrame with one row per (site, season), in the order
+    of `points`. Sites where loading or computing fails are left out and
+    listed as (lat, lon, error) in results.attrs["skipped"].
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+    if isinstance(points, pd.DataFrame):
+        coords = list(zip(points["lat"], points["lon"]))
+    else:
+        coords = [tuple(p) for p in points]
+
+    # Sites stored as the same weather store point share one download
+    if loader is None:
+        from utils import fetch_meteo
+        from weather_store import store_point
+        loader, key = fetch_meteo, lambda site: store_point(*site)
+    else:
+        key = lambda site: site
+    sites_by_key = {}
+    for site in coords:
+        sites_by_key.setdefault(key(site), []).append(site)
+
+    # The download threads are already running when the pool starts its workers,
+    # and forking a process with running threads can deadlock the child.
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    mp_context = multiprocessing.get_context(start_method)
+
+    by_site, skipped = {}, []
+    with ThreadPoolExecutor(max_workers=download_workers) as downloads, \
+            ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+        loads = {
+            downloads.submit(loader, *sites[0], start_date, end_date): sites
+            for sites in sites_by_key.values()
+        }
+        computations = {}
+        for load in as_completed(loads):
+            try:
+                df = load.result()
+            except Exception as e:
+                skipped.extend((lat, lon, str(e)) for lat, lon in loads[load])
+                continue
+            for lat, lon in loads[load]:
+                computations[executor.submit(site_results, df, lat, lon, T, F, theta)] = (lat, lon)
+        for future, (lat, lon) in computations.items():
+            try:
+                by_site[(lat, lon)] = future.result()
+            except Exception as e:
+                skipped.append((lat, lon, str(e)))
+
+    results = [by_site[site] for site in dict.fromkeys(coords) if site in by_site]
+    if results:
+        results = pd.concat(results, ignore_index=True)
+    else:
+        results = pd.DataFrame(columns=["lat", "lon", "season", "Qt (kg/m)", "Control"]
+                               + [f"{ft} (m)" for ft in FENCE_TYPES])
+    results.attrs["skipped"] = skipped
+    return results
+
+def grid_points_in_area(area, spacing=0.25, geojson_path="data/file.geojson"):
+    """
+    Build a regular lat/lon raster (spacing in degrees) inside a price-area
+    polygon, e.g. area="NO 3". Returns a DataFrame with 'lat' and 'lon'.
+    """
+    import geopandas as gpd
+
+    gdf = gpd.read_file(geojson_path).to_crs(4326)
+    poly = gdf.loc[gdf["ElSpotOmr"] == area, "geometry"].union_all()
+    if poly.is_empty:
+        raise ValueError(f"Unknown price area: {area}")
+
+    minx, miny, maxx, maxy = poly.bounds
+    lons, lats = np.meshgrid(np.arange(minx, maxx, spacing), np.arange(miny, maxy, spacing))
+    grid = gpd.GeoSeries(gpd.points_from_xy(lons.ravel(), lats.ravel()), crs=4326)
+    inside = grid[grid.within(poly)]
+    return pd.DataFrame({"lat": inside.y.to_numpy(), "lon": inside.x.to_numpy()})
+
+def corridor_points(start, end, n):
+    """
+    Return n evenly spaced points on the straight line between two
+    (lat, lon) coordinates, e.g. along a road or rail corridor.
+    """
+    return pd.DataFrame({
+        "lat": np.linspace(start[0], end[0], n),
+        "lon": np.linspace(start[1], end[1], n),
+    })
+
+def results_to_geodataframe(results):
+    """
+    Average the batch results over all seasons per site and return a point
+    GeoDataFrame (EPSG:4326) that can be drawn as a choropleth.
+    """
+    import geopandas as gpd
+
+    value_cols = ["Qt (kg/m)"] + [f"{ft} (m)" for ft in FENCE_TYPES]
+    sites = results.groupby(["lat", "lon"], as_index=False)[value_cols].mean()
+    return gpd.GeoDataFrame(sites, geometry=gpd.points_from_xy(sites["lon"], sites["lat"]), crs=4326)
+
 def main():
     # Read the CSV file (skip metadata rows so that the header is read correctly).
     filename = "open-meteo-60.57N7.60E1212m.csv"
@@ -240,15 +430,15 @@ def main():
     df['time'] = pd.to_datetime(df['time'])
     
     # Define season: if month >= 7, season = current year; otherwise, season = previous year.
-    df['season'] = df['time'].apply(lambda dt: dt.year if dt.month >= 7 else dt.year - 1)
+    assign_season(df)
     
     # Parameters for the snow transport calculation.
     T = 3000      # Maximum transport distance in meters
     F = 30000     # Fetch distance in meters
     theta = 0.5   # Relocation coefficient
     
-    # Compute seasonal results (yearly averages for each season).
-    yearly_df = compute_yearly_results(df, T, F, theta)
+    # Compute seasonal results and the directional breakdown in one pass.
+    yearly_df, sectors_df = compute_seasonal_transport(df, T, F, theta)
     overall_avg = yearly_df['Qt (kg/m)'].mean()
     print("\nYearly average snow drift (Qt) per season:")
     print(f"Overall average Qt over all seasons: {overall_avg / 1000:.1f} tonnes/m")
@@ -263,13 +453,13 @@ def main():
     print(f"\nOverall average Qt over all seasons: {overall_avg_tonnes:.1f} tonnes/m")
     
     # Compute the average directional breakdown (average over all seasons).
-    avg_sectors = compute_average_sector(df)
+    avg_sectors = sectors_df.to_numpy().mean(axis=0)
     
     # Create the rose plot canvas with the average directional breakdown.
     plot_rose(avg_sectors, overall_avg)
     
     # Compute and print necessary fence heights for each season and for three fence types.
-    fence_types = ["Wyoming", "Slat-and-wire", "Solid"]
+    fence_types = FENCE_TYPES
     fence_results = []
     for idx, row in yearly_df.iterrows():
         season = row["season"]
@@ -286,5 +476,62 @@ def main():
         "Solid (m)": lambda x: f"{x:.1f}"
     }))
 
+def batch_main(argv=None):
+    """
+    Command line entry point for batch computation, e.g.
+
+       python Snow_drift.py batch --area "NO 3" --spacing 0.5 \\
+           --start 2015-07-01 --end 2024-06-30 --out no3_drift.csv
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="Snow_drift.py batch",
+                                     description="Compute snow drift over many sites.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--points", help="CSV file with 'lat' and 'lon' columns")
+    source.add_argument("--area", help="Price area to rasterize, e.g. 'NO 3'")
+    source.add_argument("--corridor", nargs=4, type=float,
+                        metavar=("LAT1", "LON1", "LAT2", "LON2"),
+                        help="Straight corridor between two coordinates")
+    parser.add_argument("--spacing", type=float, default=0.25,
+                        help="Raster spacing in degrees (with --area)")
+    parser.add_argument("--n", type=int, default=20,
+                        help="Number of points along the corridor (with --corridor)")
+    parser.add_argument("--start", required=True, help="Start date (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, help="End date (YYYY-MM-DD)")
+    parser.add_argument("--T", type=float, default=3000, help="Maximum transport distance (m)")
+    parser.add_argument("--F", type=float, default=30000, help="Fetch distance (m)")
+    parser.add_argument("--theta", type=float, default=0.5, help="Relocation coefficient")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--downloads", type=int, default=4,
+                        help="Number of simultaneous Open-Meteo downloads")
+    parser.add_argument("--out", required=True,
+                        help="Output file; .geojson/.gpkg writes per-site means, anything else a CSV")
+    args = parser.parse_args(argv)
+
+    if args.points:
+        points = pd.read_csv(args.points)
+    elif args.area:
+        points = grid_points_in_area(args.area, args.spacing)
+    else:
+        lat1, lon1, lat2, lon2 = args.corridor
+        points = corridor_points((lat1, lon1), (lat2, lon2), args.n)
+
+    print(f"Computing snow drift for {len(points)} sites...")
+    results = compute_batch_results(points, args.start, args.end, args.T, args.F,
+                                    args.theta, max_workers=args.workers,
+                                    download_workers=args.downloads)
+    for lat, lon, error in results.attrs["skipped"]:
+        print(f"Skipped site ({lat:.4f}, {lon:.4f}): {error}")
+
+    if args.out.endswith((".geojson", ".gpkg")):
+        results_to_geodataframe(results).to_file(args.out)
+    else:
+        results.to_csv(args.out, index=False)
+    print(f"Wrote {len(results)} rows to {args.out}")
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+    else:
+        main()
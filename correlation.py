@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Rolling correlation between a meteorological and an energy series for every
+# lag at once. All window sums come from cumulative sums, so a full lag sweep
+# costs a few array operations instead of one rolling() call per lag.
+
+LAGS = np.arange(-72, 73)
+WINDOWS = (24, 48, 72, 168, 240)
+
+
+def _cumsum(a: np.ndarray) -> np.ndarray:
+    """Cumulative sum along time with a leading zero, so window sums are c[t+1] - c[t+1-w]."""
+    a = np.asarray(a, dtype=float)
+    c = np.zeros(a.shape[:-1] + (a.shape[-1] + 1,))
+    np.cumsum(a, axis=-1, out=c[..., 1:])
+    return c
+
+
+def _window_sum(c: np.ndarray, window: int) -> np.ndarray:
+    """Sums over the last `window` samples ending at every t, NaN before the first full window."""
+    n = c.shape[-1] - 1
+    out = np.full(c.shape[:-1] + (n,), np.nan)
+    if window <= n:
+        out[..., window - 1:] = c[..., window:] - c[..., :n + 1 - window]
+    return out
+
+
+def _shifted(a: np.ndarray, lags: np.ndarray, fill: float) -> np.ndarray:
+    """Row i is `a` shifted by lags[i] (out[i, t] = a[t - lags[i]]), padded with `fill`."""
+    m = int(np.abs(lags).max()) if len(lags) else 0
+    padded = np.concatenate([np.full(m, fill), a, np.full(m, fill)])
+    return sliding_window_view(padded, len(a))[m - lags]
+
+
+def rolling_lag_correlation(x, y, lags=LAGS, windows=WINDOWS) -> dict:
+    """
+    Rolling Pearson correlation of x[t] with y[t - lag] for every lag and
+    window, the same as pd.Series(x).rolling(w).corr(pd.Series(y).shift(lag)).
+
+    Returns {window: float32 array of shape (len(lags), len(x))}. Windows
+    that are incomplete, contain NaNs or have no variance are NaN.
+    """
+    lags = np.asarray(lags, dtype=int)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Centering keeps the cumulative sums small, which keeps them precise
+    x = x - np.nanmean(x)
+    y = y - np.nanmean(y)
+    valid_x, valid_y = ~np.isnan(x), ~np.isnan(y)
+    x0, y0 = np.where(valid_x, x, 0.0), np.where(valid_y, y, 0.0)
+
+    # Only the cross term depends on the lag in every sample, the sums of y
+    # for a lag are the unlagged window sums shifted by that lag
+    c_xy = _cumsum(x0 * _shifted(y0, lags, 0.0))
+    c_x, c_xx, c_nx = _cumsum(x0), _cumsum(x0 ** 2), _cumsum(valid_x)
+    c_y, c_yy, c_ny = _cumsum(y0), _cumsum(y0 ** 2), _cumsum(valid_y)
+    scale = np.nanvar(x) * np.nanvar(y)
+
+    results = {}
+    for window in windows:
+        sx, sxx = _window_sum(c_x, window), _window_sum(c_xx, window)
+        sy = _shifted(_window_sum(c_y, window), lags, np.nan)
+        syy = _shifted(_window_sum(c_yy, window), lags, np.nan)
+        full = (_window_sum(c_nx, window) == window) & (_shifted(_window_sum(c_ny, window), lags, 0.0) == window)
+
+        cov = _window_sum(c_xy, window) - sx * sy / window
+        var = (sxx - sx ** 2 / window) * (syy - sy ** 2 / window)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = cov / np.sqrt(var)
+        corr[~full | (var <= 1e-12 * scale * window ** 2)] = np.nan
+        results[window] = np.clip(corr, -1, 1).astype(np.float32)
+    return results
+
+
+def align_hourly(met: pd.Series, energy: pd.Series) -> pd.DataFrame:
+    """Hourly meteo (interpolated) and energy (daily values held) on their common hours."""
+    met = met.resample("h").interpolate()
+    energy = energy.resample("h").ffill()
+    return pd.concat([met.rename("meteo"), energy.rename("energy")], axis=1).dropna()
+
+
+# Lag x time correlation matrix for one window, as a frame indexed by time with
+# one column per lag. Moving the lag slider only selects a cached column.
+# cache_resource hands every rerun the same frame instead of unpickling a copy
+# of it, so callers must treat the matrix as read-only
+@st.cache_resource(max_entries=16)
+def correlation_matrix(met: pd.Series, energy: pd.Series, window: int, lags=tuple(LAGS)) -> pd.DataFrame:
+    merged = align_hourly(met, energy)
+    corr = rolling_lag_correlation(merged["meteo"], merged["energy"], np.asarray(lags), (window,))[window]
+    return pd.DataFrame(corr.T, index=merged.index, columns=pd.Index(lags, name="lag"))
+
+
+def best_lag(matrix: pd.DataFrame) -> pd.DataFrame:
+    """Lag with the strongest (absolute) correlation at every time, and that correlation."""
+    values = matrix.to_numpy()
+    has_value = ~np.isnan(values).all(axis=1)
+    idx = np.argmax(np.where(np.isnan(values), -1.0, np.abs(values)), axis=1)
+    lags = matrix.columns.to_numpy()[idx].astype(float)
+    corr = values[np.arange(len(values)), idx]
+    lags[~has_value] = np.nan
+    corr[~has_value] = np.nan
+    return pd.DataFrame({"lag": lags, "corr": corr}, index=matrix.index)
@@ -0,0 +1,240 @@
+"""
+Parallel, resumable ingestion of hourly Elhub energy data.
+
+The Elhub API is queried per (dataset, year, month) chunk with bounded
+parallelism and retries. Every chunk is normalized into the lowercase record
+layout used in MongoDB and streamed into a sink in batches. Completed chunks
+are recorded in a checkpoint file, so a failed run resumes where it stopped.
+Years are written to their time partition (mongodb.PARTITIONS), each
+collection with its own checkpoint.
+
+Example:
+   python elhub.py consumption 2021 2024
+"""
+
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+
+import requests
+
+from retry_requests import retry
+
+BASE_URL = "https://api.elhub.no/energy-data/v0/price-areas"
+CHECKPOINT_DIR = Path(__file__).parent / "data" / "elhub_checkpoints"
+
+# dataset name -> (API dataset, attribute holding the rows, group field)
+DATASETS = {
+    "consumption": ("CONSUMPTION_PER_GROUP_MBA_HOUR", "consumptionPerGroupMbaHour", "consumptionGroup"),
+    "production": ("PRODUCTION_PER_GROUP_MBA_HOUR", "productionPerGroupMbaHour", "productionGroup"),
+}
+
+_local = threading.local()
+
+
+def get_session():
+    """One retrying session per worker thread."""
+    if not hasattr(_local, "session"):
+        _local.session = retry(requests.Session(), retries=5, backoff_factor=0.5)
+    return _local.session
+
+
+def month_chunks(start_year: int, end_year: int) -> list:
+    return [(year, month) for year in range(start_year, end_year + 1) for month in range(1, 13)]
+
+
+def _to_utc(value):
+    # Elhub sends local time with offset, MongoDB stores naive UTC datetimes
+    if value is None:
+        return None
+    return datetime.fromisoformat(value).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def normalize_records(payload: dict, dataset: str) -> list:
+    """Flatten an API response into records with lowercase field names."""
+    _, attribute, group_field = DATASETS[dataset]
+    records = []
+    for item in payload.get("data", []):
+        rows = item.get("attributes", {}).get(attribute, [])
+        if not isinstance(rows, list):
+            continue
+        for row in rows:
+            records.append({
+                "pricearea": row.get("priceArea"),
+                group_field.lower(): row.get(group_field),
+                "quantitykwh": row.get("quantityKwh"),
+                "starttime": _to_utc(row.get("startTime")),
+                "endtime": _to_utc(row.get("endTime")),
+                "meteringpointcount": row.get("meteringPointCount"),
+                "lastupdatedtime": _to_utc(row.get("lastUpdatedTime")),
+            })
+    return records
+
+
+def fetch_chunk(dataset: str, year: int, month: int, base_url: str = BASE_URL) -> list:
+    """Fetch and normalize one month of a dataset."""
+    start = f"{year}-{month:02d}-01"
+    end = f"{year + 1}-01-01" if month == 12 else f"{year}-{month + 1:02d}-01"
+    params = {"startDate": start, "endDate": end, "dataset": DATASETS[dataset][0]}
+    response = get_session().get(base_url, params=params, timeout=60)
+    response.raise_for_status()
+    return normalize_records(response.json(), dataset)
+
+
+def checkpoint_path(dataset: str, collection: str) -> Path:
+    return CHECKPOINT_DIR / f"{dataset}_{collection}.json"
+
+
+def load_checkpoint(path: Path) -> set:
+    if not path.exists():
+        return set()
+    return {tuple(chunk) for chunk in json.loads(path.read_text())}
+
+
+def save_checkpoint(path: Path, done: set):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(sorted(done)))
+    os.replace(tmp, path)
+
+
+def ingest(dataset: str, start_year: int, end_year: int, sink, checkpoint: Path = None,
+           max_workers: int = 4, batch_size: int = 10_000, base_url: str = BASE_URL,
+           on_chunk=None) -> dict:
+    """
+    Fetch every month of [start_year, end_year] concurrently and stream the
+    records into `sink(batch)` in batches of at most `batch_size`. After all
+    batches of a chunk are written, `on_chunk(records)` is called with them.
+
+    Chunks listed in the checkpoint file are skipped. A chunk is added to the
+    checkpoint only after all of its records were written. Failed chunks are
+    reported and left for the next run.
+    """
+    done = load_checkpoint(checkpoint) if checkpoint else set()
+    todo = [chunk for chunk in month_chunks(start_year, end_year) if chunk not in done]
+    stats = {"chunks": 0, "records": 0, "failed": [], "skipped": len(done)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_chunk, dataset, year, month, base_url): (year, month)
+            for year, month in todo
+        }
+        # The sink is only called from this thread
+        for future in as_completed(futures):
+            year, month = futures[future]
+            try:
+                records = future.result()
+            except Exception as e:
+                print(f"Failed {dataset} {year}-{month:02d}: {e}")
+                stats["failed"].append((year, month))
+                continue
+
+            for i in range(0, len(records), batch_size):
+                sink(records[i:i + batch_size])
+            if on_chunk:
+                on_chunk(records)
+
+            done.add((year, month))
+            if checkpoint:
+                save_checkpoint(checkpoint, done)
+            stats["chunks"] += 1
+            stats["records"] += len(records)
+            print(f"Ingested {dataset} {year}-{month:02d}: {len(records)} records")
+
+    return stats
+
+
+def mongo_sink(collection, dataset: str):
+    """
+    Sink that upserts every batch into a MongoDB collection, keyed by
+    (pricearea, group, starttime). Returns the sink and its running totals.
+
+    Duplicate rows left by the old insert-only notebooks are removed and the
+    unique key and range query indexes are created once here, not for every
+    batch.
+    """
+    from mongodb import drop_duplicate_rows, ensure_indexes, upsert_records
+
+    group_field = DATASETS[dataset][2].lower()
+    dropped = drop_duplicate_rows(collection, group_field)
+    if dropped:
+        print(f"Removed {dropped} duplicate rows from {collection.name}")
+    ensure_indexes(dataset, [collection])
+    totals = {"inserted": 0, "updated": 0, "skipped": 0, "failed": 0, "seconds": 0.0}
+
+    def write(batch):
+        if batch:
+            stats = upsert_records(collection, batch, group_field=group_field, batch_size=len(batch))
+            for key in totals:
+                totals[key] += stats[key]
+
+    return write, totals
+
+
+def ingest_partition(dataset: str, start_year: int, end_year: int, collection_name: str, collection,
+                     restart: bool = False, max_workers: int = 4, batch_size: int = 10_000) -> dict:
+    """
+    Ingest [start_year, end_year] into one collection, with the checkpoint
+    of that collection, and keep its page rollups in step.
+    """
+    from rollups import update_rollups
+
+    checkpoint = checkpoint_path(dataset, collection_name)
+    if restart and checkpoint.exists():
+        checkpoint.unlink()
+
+    # Keep the page rollups in step with every month that was written
+    def refresh_rollups(records):
+        update_rollups(collection_name, [r["starttime"] for r in records], source=collection)
+
+    sink, totals = mongo_sink(collection, dataset)
+    stats = ingest(dataset, start_year, end_year, sink,
+                   checkpoint=checkpoint, max_workers=max_workers, batch_size=batch_size,
+                   on_chunk=refresh_rollups)
+    print(f"Done {collection_name}: {stats['records']} records in {stats['chunks']} chunks, "
+          f"{stats['skipped']} chunks already done, {len(stats['failed'])} failed")
+    rate = stats["records"] / totals["seconds"] if totals["seconds"] > 0 else 0.0
+    print(f"MongoDB: {totals['inserted']} inserted, {totals['updated']} updated, "
+          f"{totals['skipped']} unchanged, {totals['failed']} failed ({rate:,.0f} rows/s)")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest hourly Elhub data into MongoDB.")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("start_year", type=int)
+    parser.add_argument("end_year", type=int)
+    parser.add_argument("--collection", help="Target collection (default: the time partition of every year)")
+    parser.add_argument("--uri", help="MongoDB URI (default: mongo.uri from the Streamlit secrets)")
+    parser.add_argument("--workers", type=int, default=4, help="Number of parallel requests")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Records per write")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and fetch everything")
+    args = parser.parse_args(argv)
+
+    from mongodb import DATABASE, partition_for_year
+
+    # Collection -> the requested years it holds. Partitions cover contiguous
+    # years, so every collection is ingested as one year range
+    partitions = {}
+    for year in range(args.start_year, args.end_year + 1):
+        name = args.collection or partition_for_year(args.dataset, year)
+        partitions.setdefault(name, []).append(year)
+
+    if args.uri:
+        import pymongo
+        database = pymongo.MongoClient(args.uri)[DATABASE]
+        get_collection = database.get_collection
+    else:
+        from mongodb import get_collection
+
+    for collection_name, years in partitions.items():
+        ingest_partition(args.dataset, years[0], years[-1], collection_name, get_collection(collection_name),
+                         restart=args.restart, max_workers=args.workers, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
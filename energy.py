@@ -0,0 +1,59 @@
+import pandas as pd
+import streamlit as st
+
+from mongodb import find_hourly, partitions_for
+from rollups import load_rollup
+
+# Daily Production/Consumption per price area, read from the daily Elhub
+# rollups of every time partition a date range spans. All pages share this
+# provider instead of building their own energy series.
+
+ENERGY_GROUPS = ["Production", "Consumption"]
+DATASETS = {"Production": "production", "Consumption": "consumption"}
+
+# Price areas as they are named in data/file.geojson (ElSpotOmr)
+AREAS = ["NO 1", "NO 2", "NO 3", "NO 4", "NO 5"]
+
+
+def area_label(pricearea: str) -> str:
+    """Elhub "NO1" -> GeoJSON "NO 1"."""
+    return f"{pricearea[:2]} {pricearea[2:]}"
+
+
+# Sum of all groups in kWh per day, one column per area in AREAS.
+# Days without data in the store are NaN.
+@st.cache_data(ttl=600)
+def daily_energy(group: str, start_date, end_date) -> pd.DataFrame:
+    dataset = DATASETS[group]
+    index = pd.date_range(start_date, end_date, freq="D", name="date")
+    end = index[-1] + pd.Timedelta(days=1)
+
+    frames = [load_rollup("daily", name).reset_index() for name in partitions_for(dataset, index[0], end)]
+    if not frames:
+        return pd.DataFrame(index=index, columns=AREAS, dtype="float64")
+    rows = pd.concat(frames, ignore_index=True)
+    rows["date"] = pd.to_datetime(rows[["year", "month", "day"]])
+    rows = rows[(rows["date"] >= index[0]) & (rows["date"] < end)]
+
+    daily = rows.pivot_table(index="date", columns="pricearea", values="quantitykwh", aggfunc="sum", observed=True)
+    daily.columns = [area_label(str(area)) for area in daily.columns]
+    return daily.reindex(index=index, columns=AREAS)
+
+
+# Sum of all groups in kWh per hour for one area in AREAS, in naive UTC like
+# the weather data. Read from the raw rows of that area only, which is a range
+# scan on the (pricearea, starttime) index. Hours without data are NaN.
+@st.cache_data(ttl=600)
+def hourly_energy(group: str, area: str, start_date, end_date) -> pd.Series:
+    start = pd.Timestamp(start_date)
+    end = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+    index = pd.date_range(start, end, freq="h", inclusive="left", name="time")
+
+    rows = find_hourly(DATASETS[group], start, end, pricearea=area.replace(" ", ""))
+    hourly = rows.groupby("starttime")["quantitykwh"].sum().astype("float64")
+    return hourly.reindex(index).rename(area)
+
+
+def energy_data(start_date, end_date) -> dict:
+    """Daily series of every energy group, keyed like ENERGY_GROUPS."""
+    return {group: daily_energy(group, start_date, end_date) for group in ENERGY_GROUPS}
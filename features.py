@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import fetch_meteo
+from weather_store import store_point
+
+# Daily exogenous features for the energy forecasts. The hourly weather is
+# resampled to days once, derived features and lags are built from that daily
+# frame, and future values come from a day-of-year climatology of a long
+# ERA5 history instead of repeating the last observed day.
+
+TEMPERATURE = "temperature_2m (°C)"
+WIND_SPEED = "wind_speed_10m (m/s)"
+
+HDD_BASE = 17.0  # °C, Norwegian convention for heating degree days
+HEATING_DEGREE_DAYS = "heating_degree_days"
+WIND_POWER = "wind_power (u³)"
+
+LAG_DAYS = (1, 2, 7)
+CLIMATOLOGY_YEARS = 30
+CLIMATOLOGY_SMOOTHING = 15  # days, centered
+
+
+def lag_column(col: str, days: int) -> str:
+    return f"{col} (lag {days}d)"
+
+
+# Daily means of the hourly weather, plus heating degree days (from the daily
+# mean temperature) and the daily mean of u³, which follows wind power better
+# than the mean wind speed does
+@st.cache_data(max_entries=8)
+def daily_weather(df: pd.DataFrame) -> pd.DataFrame:
+    hourly = df.drop(columns=["season"], errors="ignore").set_index("time")
+    hourly.index = pd.DatetimeIndex(hourly.index).tz_localize(None)
+    hourly = hourly.astype("float64")
+    if WIND_SPEED in hourly.columns:
+        hourly[WIND_POWER] = hourly[WIND_SPEED] ** 3
+
+    daily = hourly.resample("D").mean()
+    daily.index.name = "date"
+    if TEMPERATURE in daily.columns:
+        daily[HEATING_DEGREE_DAYS] = (HDD_BASE - daily[TEMPERATURE]).clip(lower=0)
+    return daily
+
+
+def feature_columns(daily: pd.DataFrame) -> list:
+    """Every feature that can be selected: the daily columns and their lags."""
+    return [*daily.columns, *(lag_column(col, days) for col in daily.columns for days in LAG_DAYS)]
+
+
+def _with_lags(daily: pd.DataFrame, columns) -> pd.DataFrame:
+    """The requested columns of `daily`, building lag columns on the fly."""
+    features = {}
+    for col in columns:
+        if col in daily.columns:
+            features[col] = daily[col]
+            continue
+        for base in daily.columns:
+            for days in LAG_DAYS:
+                if col == lag_column(base, days):
+                    features[col] = daily[base].shift(days)
+        if col not in features:
+            raise KeyError(f"Unknown feature: {col}")
+    return pd.DataFrame(features, index=daily.index)
+
+
+# Exog matrix for the days [start, end] of a training series, gaps interpolated
+@st.cache_data(max_entries=32)
+def exog_matrix(daily: pd.DataFrame, columns: tuple, start, end) -> pd.DataFrame:
+    index = pd.date_range(start, end, freq="D", name="date")
+    features = _with_lags(daily, list(columns))
+    return features.reindex(index).interpolate(limit_direction="both")
+
+
+def climatology(lat: float, lon: float, years: int = CLIMATOLOGY_YEARS) -> pd.DataFrame:
+    """
+    Mean of every daily feature per day of the year over the last `years`
+    full years at a location, smoothed with a centered circular rolling mean.
+    """
+    return _point_climatology(store_point(lat, lon), pd.Timestamp.today().year - 1, years)
+
+
+# Persisted by Streamlit and keyed like the weather store, so the long history
+# is only read once per point
+@st.cache_data(persist="disk")
+def _point_climatology(point: tuple, last_year: int, years: int) -> pd.DataFrame:
+    df = fetch_meteo(point[0], point[1], f"{last_year - years + 1}-01-01", f"{last_year}-12-31")
+    daily = daily_weather(df)
+
+    by_day = daily.groupby(daily.index.dayofyear).mean().reindex(np.arange(1, 367))
+    by_day = by_day.interpolate(limit_direction="both")
+    half = CLIMATOLOGY_SMOOTHING // 2
+    wrapped = pd.concat([by_day.iloc[-half:], by_day, by_day.iloc[:half]])
+    smoothed = wrapped.rolling(CLIMATOLOGY_SMOOTHING, center=True).mean().iloc[half:-half]
+    smoothed.index.name = "dayofyear"
+    return smoothed
+
+
+def future_exog(daily: pd.DataFrame, columns, index: pd.DatetimeIndex, normals: pd.DataFrame) -> pd.DataFrame:
+    """
+    Exog for forecast dates: climatology for the daily features, and for lags
+    the observed values where the lagged day is in the history.
+
+    Missing observed days are interpolated between their neighbours, and
+    filled from the climatology of the day they belong to at the edges, so
+    the result has no NaN the forecast would choke on.
+    """
+    index = pd.DatetimeIndex(index)
+    columns = list(columns)
+    base = [col for col in daily.columns if col in normals.columns]
+
+    def normal_days(days):
+        return normals.reindex(days.dayofyear).set_axis(days)[base]
+
+    future = normal_days(index)
+    combined = pd.concat([daily, future.loc[future.index > daily.index[-1]]])
+    features = _with_lags(combined, columns).reindex(index).interpolate(limit_area="inside")
+
+    days = pd.date_range(index[0] - pd.Timedelta(days=max(LAG_DAYS)), index[-1], freq="D")
+    expected = _with_lags(normal_days(days), columns).reindex(index)
+    return features.fillna(expected).ffill().bfill()
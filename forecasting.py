@@ -0,0 +1,518 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import warnings
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+# Process pools start their workers from a fork server (spawn where there is
+# none): the Streamlit app and the registry run threads, and forking a process
+# with running threads can deadlock the child.
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Registry of fitted SARIMAX models, shared by every session of the app.
+# A fit is keyed by the training data and the model specification. The most
+# recently used results are kept in memory, evicted ones are pickled to disk,
+# where only the MAX_SPILLED most recently used pickles are kept.
+# When the training window is only extended, the new fit starts from the
+# parameters of a shorter one that is still in memory.
+
+MODEL_DIR = Path(__file__).parent / "data" / "models"
+MAX_MODELS = 16
+MAX_SPILLED = 64
+
+_models = OrderedDict()  # key -> fitted results, in LRU order
+_fits = {}  # key -> (family, training end, series) of the fits in _models, for warm starts
+_lock = threading.Lock()
+_key_locks = defaultdict(threading.Lock)  # one fit per key at a time, dropped on eviction
+
+
+def _hash_frame(data) -> str:
+    if data is None:
+        return ""
+    hashed = pd.util.hash_pandas_object(data, index=True).to_numpy()
+    columns = ",".join(map(str, data.columns)) if isinstance(data, pd.DataFrame) else str(data.name)
+    return hashlib.sha1(hashed.tobytes() + columns.encode()).hexdigest()
+
+
+def model_family(series: pd.Series, order, seasonal_order, exog=None) -> tuple:
+    """Everything that identifies a model except the end of its training window."""
+    exog_columns = tuple(exog.columns) if exog is not None else ()
+    return (str(series.name), tuple(order), tuple(seasonal_order), exog_columns, str(series.index[0]))
+
+
+def model_key(series: pd.Series, order, seasonal_order, exog=None) -> str:
+    """Key of a fit: hash of the series and exog (values and window) plus the specification."""
+    parts = [_hash_frame(series), _hash_frame(exog), repr(model_family(series, order, seasonal_order, exog)),
+             str(series.index[-1])]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def model_path(key: str) -> Path:
+    return MODEL_DIR / f"{key}.pkl"
+
+
+def fit_sarimax(series: pd.Series, order, seasonal_order, exog=None, start_params=None):
+    model = SARIMAX(
+        series,
+        order=tuple(order),
+        seasonal_order=tuple(seasonal_order),
+        exog=exog,
+        enforce_stationarity=False,
+        enforce_invertibility=False,
+    )
+    return model.fit(start_params=start_params, disp=False)
+
+
+def _remember(key: str, results):
+    _models[key] = results
+    _models.move_to_end(key)
+    while len(_models) > MAX_MODELS:
+        old_key, old_results = _models.popitem(last=False)
+        _fits.pop(old_key, None)
+        _key_locks.pop(old_key, None)
+        _spill(old_key, old_results)
+
+
+# Write through a temporary file, so other processes never load a partial pickle
+def _spill(key: str, results):
+    path = model_path(key)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(results, f)
+        os.replace(tmp, path)
+    _prune_spilled()
+
+
+def _prune_spilled(keep: int = None):
+    """Delete all but the `keep` (default MAX_SPILLED) most recently used pickles."""
+    keep = MAX_SPILLED if keep is None else keep
+    paths = []
+    for path in MODEL_DIR.glob("*.pkl"):
+        try:
+            paths.append((path.stat().st_mtime, path))
+        except FileNotFoundError:  # pruned by another process
+            pass
+    for _, path in sorted(paths, reverse=True)[keep:]:
+        path.unlink(missing_ok=True)
+
+
+def _load_spilled(key: str):
+    path = model_path(key)
+    try:
+        with open(path, "rb") as f:
+            results = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    os.utime(path)  # mark as recently used for _prune_spilled
+    return results
+
+
+def warm_start_params(series: pd.Series, order, seasonal_order, exog=None):
+    """
+    Parameters of the longest earlier fit of the same model whose training
+    series is a prefix of `series`, or None.
+    """
+    family = model_family(series, order, seasonal_order, exog)
+    best = None
+    with _lock:
+        fits = list(_fits.items())
+    for key, (fit_family, end, fit_series) in fits:
+        if fit_family != family or end >= series.index[-1]:
+            continue
+        if best is not None and end <= best[1]:
+            continue
+        if series.loc[:end].equals(fit_series):
+            best = (key, end)
+    if best is None:
+        return None
+    with _lock:
+        results = _models.get(best[0])
+    if results is None:
+        results = _load_spilled(best[0])
+    return None if results is None else results.params
+
+
+def get_results(series: pd.Series, order, seasonal_order, exog=None):
+    """
+    Fitted SARIMAX results for a training series, from memory, from disk or
+    from a new (warm-started where possible) fit.
+    """
+    key = model_key(series, order, seasonal_order, exog)
+    with _lock:
+        key_lock = _key_locks[key]
+    with key_lock:
+        with _lock:
+            results = _models.get(key)
+        if results is None:
+            results = _load_spilled(key)
+        if results is None:
+            start_params = warm_start_params(series, order, seasonal_order, exog)
+            try:
+                results = fit_sarimax(series, order, seasonal_order, exog, start_params)
+            except Exception:
+                with _lock:
+                    _key_locks.pop(key, None)  # nothing is stored for the key
+                raise
+            with _lock:
+                _fits[key] = (model_family(series, order, seasonal_order, exog), series.index[-1], series)
+        with _lock:
+            _remember(key, results)
+    return results
+
+
+def order_grid(p=range(3), d=(0, 1), q=range(3), P=range(2), D=(0, 1), Q=range(2), s=7) -> list:
+    """Candidate (order, seasonal_order) pairs for the grid search."""
+    return [((p_, d_, q_), (P_, D_, Q_, s)) for p_, d_, q_, P_, D_, Q_ in product(p, d, q, P, D, Q)]
+
+
+def differencing_orders(series: pd.Series, s: int = 7, alpha: float = 0.05, max_d: int = 1, max_D: int = 1) -> tuple:
+    """
+    (d, D) for a series, chosen by tests before the order search: information
+    criteria of models with different differencing are computed on different
+    data and cannot be ranked against each other.
+
+    D is 1 when the seasonal strength of an STL decomposition exceeds 0.64
+    (the threshold of R's nsdiffs). d is the number of differences after
+    which a KPSS test no longer rejects stationarity at level `alpha`.
+    """
+    from statsmodels.tsa.seasonal import STL
+    from statsmodels.tsa.stattools import kpss
+
+    y = series.interpolate(limit_direction="both").dropna()
+    if y.nunique() < 2:
+        return 0, 0
+    D = 0
+    if max_D > 0 and s > 1 and len(y) > 2 * s:
+        decomposition = STL(y.to_numpy(), period=s).fit()
+        remainder = decomposition.resid
+        strength = 1 - np.var(remainder) / np.var(remainder + decomposition.seasonal)
+        if strength > 0.64:
+            D = 1
+            y = y.diff(s).dropna()
+
+    d = 0
+    while d < max_d and len(y) > 10:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # p-values outside the lookup table
+                p_value = kpss(y, regression="c", nlags="auto")[1]
+        except (ValueError, ZeroDivisionError):
+            break
+        if not p_value < alpha:
+            break
+        y = y.diff().dropna()
+        d += 1
+    return d, D
+
+
+def with_differencing(grid, d: int, D: int) -> list:
+    """The candidates of `grid` with their differencing replaced by (d, D), without duplicates."""
+    candidates = []
+    for (p_, _, q_), (P_, _, Q_, s_) in grid:
+        candidate = ((p_, d, q_), (P_, D, Q_, s_))
+        if candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+
+def score_candidate(series: pd.Series, order, seasonal_order, exog=None, maxiter=50, start_params=None) -> dict:
+    """
+    Cheap fit of one candidate for ranking, with the scale concentrated out
+    of the likelihood (one parameter less to optimize). Models without any
+    other parameter are fitted normally. Failed fits score inf.
+
+    low_memory is not used: combined with a concentrated scale statsmodels
+    reports a wrong log-likelihood.
+    """
+    start = time.perf_counter()
+    row = {"order": tuple(order), "seasonal_order": tuple(seasonal_order), "aic": np.inf, "bic": np.inf,
+           "params": None, "error": None}
+    for concentrate_scale in (True, False):
+        try:
+            model = SARIMAX(
+                series,
+                order=tuple(order),
+                seasonal_order=tuple(seasonal_order),
+                exog=exog,
+                enforce_stationarity=False,
+                enforce_invertibility=False,
+                concentrate_scale=concentrate_scale,
+            )
+            if model.k_params == 0:
+                continue
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                results = model.fit(start_params=start_params, maxiter=maxiter, disp=False)
+        except Exception as e:
+            row["error"] = str(e)
+            continue
+        if np.isfinite(results.llf):
+            row.update(aic=results.aic, bic=results.bic, params=np.asarray(results.params), error=None)
+        break
+    row["seconds"] = time.perf_counter() - start
+    return row
+
+
+def _score_task(task):
+    name, series, exog, order, seasonal_order, maxiter, start_params = task
+    return {"series": name, **score_candidate(series, order, seasonal_order, exog, maxiter, start_params)}
+
+
+def grid_search_many(series: dict, grid=None, exog: dict = None, criterion="aic", max_workers=None,
+                     prune_iter=10, margin=10.0, keep=3, maxiter=50) -> pd.DataFrame:
+    """
+    Rank the orders of `grid` for every series of `series` (name -> Series)
+    in one process pool. The differencing (d, D) of every series is fixed by
+    differencing_orders first, so only p, q, P and Q are searched and every
+    candidate of a series is scored on the same differenced data.
+
+    Every candidate is first fitted for only `prune_iter` optimizer
+    iterations. Candidates more than `margin` worse than the best of their
+    series are pruned, except the `keep` best. The rest are fitted to
+    convergence, starting from their pruning-round parameters.
+
+    Returns the leaderboard, ranked by `criterion` within every series, with
+    a 'stage' column telling whether a row is a full fit or was pruned.
+    """
+    grid = grid or order_grid()
+    exog = exog or {}
+
+    periods = sorted({seasonal_order[3] for _, seasonal_order in grid})
+    candidates = {}
+    for name, s in series.items():
+        for period in periods:
+            d, D = differencing_orders(s, period)
+            candidates.setdefault(name, []).extend(
+                with_differencing([c for c in grid if c[1][3] == period], d, D))
+
+    with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context(START_METHOD)) as executor:
+        tasks = [(name, s, exog.get(name), order, seasonal_order, prune_iter, None)
+                 for name, s in series.items() for order, seasonal_order in candidates[name]]
+        first = pd.DataFrame(executor.map(_score_task, tasks))
+
+        best = first.groupby("series")[criterion].transform("min")
+        rank = first.groupby("series")[criterion].rank(method="first")
+        survivors = first[(first[criterion] <= best + margin) | (rank <= keep)]
+        survivors = survivors[np.isfinite(survivors[criterion])]
+
+        tasks = [(row.series, series[row.series], exog.get(row.series), row.order, row.seasonal_order,
+                  maxiter, row.params)
+                 for row in survivors.itertuples()]
+        second = pd.DataFrame(executor.map(_score_task, tasks), columns=first.columns)
+
+    first["stage"] = "pruned"
+    second["stage"] = "full"
+    pruned = first.drop(survivors.index)
+    leaderboard = pd.concat([second, pruned], ignore_index=True)
+    leaderboard = leaderboard.sort_values(["series", "stage", criterion], ascending=[True, True, True])
+    leaderboard["rank"] = leaderboard.groupby("series").cumcount() + 1
+    return leaderboard.drop(columns="params").reset_index(drop=True)
+
+
+def grid_search(series: pd.Series, grid=None, exog=None, criterion="aic", **kwargs):
+    """
+    Order search for one series. Returns the leaderboard and the best model,
+    refitted through the registry so it is ready for forecasting. Raises
+    ValueError if no candidate could be fitted.
+    """
+    name = str(series.name)
+    leaderboard = grid_search_many({name: series}, grid, {name: exog}, criterion, **kwargs)
+    if leaderboard.empty or not np.isfinite(leaderboard[criterion].iloc[0]):
+        raise ValueError("none of the candidate orders could be fitted")
+    best = leaderboard.iloc[0]
+    return leaderboard, get_results(series, best["order"], best["seasonal_order"], exog)
+
+
+def forecast_frame(results, steps: int, exog=None, alpha=0.05) -> pd.DataFrame:
+    """Forecast of fitted results as columns forecast, lower and upper, indexed by date."""
+    forecast = results.get_forecast(steps=steps, exog=exog)
+    conf_int = forecast.conf_int(alpha=alpha)
+    return pd.DataFrame({
+        "forecast": forecast.predicted_mean.to_numpy(),
+        "lower": conf_int.iloc[:, 0].to_numpy(),
+        "upper": conf_int.iloc[:, 1].to_numpy(),
+    }, index=pd.Index(forecast.predicted_mean.index, name="date"))
+
+
+def _forecast_task(task):
+    group, area, series, order, seasonal_order, horizon, alpha = task
+    series = series.loc[series.first_valid_index():series.last_valid_index()]
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            results = fit_sarimax(series, order, seasonal_order)
+            frame = forecast_frame(results, horizon, alpha=alpha)
+    except Exception as e:
+        return group, area, None, str(e)
+    return group, area, frame.reset_index(), None
+
+
+def forecast_all(time_series_data: dict, horizon=30, order=(1, 1, 1), seasonal_order=(0, 1, 1, 7),
+                 orders: dict = None, alpha=0.05, max_workers=None) -> pd.DataFrame:
+    """
+    Fit and forecast every area of every group of `time_series_data`
+    ({group: frame with one column per area}) in parallel processes.
+
+    `orders` can give a (order, seasonal_order) per (group, area). Returns
+    one long table with group, area, date, forecast, lower and upper. Series
+    without data or with failed fits are listed in df.attrs["failed"].
+    """
+    orders = orders or {}
+    tasks = [
+        (group, area, frame[area], *orders.get((group, area), (order, seasonal_order)), horizon, alpha)
+        for group, frame in time_series_data.items()
+        for area in frame.columns
+        if frame[area].notna().any()
+    ]
+    skipped = [(group, area, "no data") for group, frame in time_series_data.items()
+               for area in frame.columns if not frame[area].notna().any()]
+
+    with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context(START_METHOD)) as executor:
+        done = list(executor.map(_forecast_task, tasks))
+
+    frames = [frame.assign(group=group, area=area) for group, area, frame, _ in done if frame is not None]
+    columns = ["group", "area", "date", "forecast", "lower", "upper"]
+    df = pd.concat(frames, ignore_index=True)[columns] if frames else pd.DataFrame(columns=columns)
+    df.attrs["failed"] = skipped + [(group, area, error) for group, area, _, error in done if error is not None]
+    return df
+
+
+def export_forecasts(df: pd.DataFrame, path):
+    """Write a forecast table as Parquet or CSV, depending on the file suffix."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def _backtest_task(task):
+    train, exog_train, exog_future, order, seasonal_order, params, horizon, alpha = task
+    model = SARIMAX(
+        train,
+        order=tuple(order),
+        seasonal_order=tuple(seasonal_order),
+        exog=exog_train,
+        enforce_stationarity=False,
+        enforce_invertibility=False,
+    )
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        # Run the Kalman filter with the fitted parameters, no optimization
+        results = model.filter(params)
+        return forecast_frame(results, horizon, exog_future, alpha)
+
+
+def backtest(series: pd.Series, order, seasonal_order, exog=None, initial=None, horizon=14, step=7,
+             window="expanding", alpha=0.05, max_workers=None):
+    """
+    Rolling-origin evaluation of one SARIMAX specification.
+
+    The model is fitted once, on the first `initial` days (default: half of
+    the series). Every `step` days after that is a forecast origin. There the
+    fitted parameters are only re-filtered over the data seen so far (all of
+    it for window="expanding", the last `initial` days for "sliding"), and
+    `horizon` days are forecast with the observed exog. Origins run in
+    parallel processes.
+
+    Returns the metrics per horizon step (MAE, MAPE in %, interval coverage)
+    and the long table of all backtest forecasts.
+    """
+    series = series.loc[series.first_valid_index():series.last_valid_index()]
+    if exog is not None:
+        exog = exog.reindex(series.index)
+    initial = initial or len(series) // 2
+    origins = range(initial, len(series) - horizon + 1, step)
+    if len(origins) == 0:
+        raise ValueError("The series is too short for this initial window and horizon")
+
+    params = get_results(series.iloc[:initial], order, seasonal_order,
+                         None if exog is None else exog.iloc[:initial]).params
+
+    tasks = []
+    for origin in origins:
+        first = origin - initial if window == "sliding" else 0
+        tasks.append((
+            series.iloc[first:origin],
+            None if exog is None else exog.iloc[first:origin],
+            None if exog is None else exog.iloc[origin:origin + horizon],
+            order, seasonal_order, params, horizon, alpha,
+        ))
+    with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context(START_METHOD)) as executor:
+        frames = list(executor.map(_backtest_task, tasks, chunksize=max(1, len(tasks) // 16)))
+
+    forecasts = pd.concat([
+        frame.reset_index().assign(origin=series.index[origin], step=np.arange(1, horizon + 1),
+                                   actual=series.iloc[origin:origin + horizon].to_numpy())
+        for origin, frame in zip(origins, frames)
+    ], ignore_index=True)[["origin", "step", "date", "actual", "forecast", "lower", "upper"]]
+
+    error = forecasts["forecast"] - forecasts["actual"]
+    actual = forecasts["actual"].where(forecasts["actual"] != 0)
+    scored = forecasts.assign(
+        abs_error=error.abs(),
+        abs_pct_error=(error / actual).abs() * 100,
+        covered=((forecasts["lower"] <= forecasts["actual"]) & (forecasts["actual"] <= forecasts["upper"]))
+        .where(forecasts["actual"].notna()),
+    )
+    metrics = scored.groupby("step").agg(
+        MAE=("abs_error", "mean"),
+        MAPE=("abs_pct_error", "mean"),
+        coverage=("covered", "mean"),
+        origins=("actual", "count"),
+    )
+    return metrics, forecasts
+
+
+def main(argv=None):
+    from energy import energy_data
+
+    parser = argparse.ArgumentParser(description="Forecast daily energy for every price area and group.")
+    parser.add_argument("start_date", help="First training day, e.g. 2022-01-01")
+    parser.add_argument("end_date", help="Last training day")
+    parser.add_argument("--horizon", type=int, default=30, help="Days to forecast")
+    parser.add_argument("--order", type=int, nargs=3, default=(1, 1, 1), metavar=("p", "d", "q"))
+    parser.add_argument("--seasonal-order", type=int, nargs=4, default=(0, 1, 1, 7), metavar=("P", "D", "Q", "s"))
+    parser.add_argument("--search", action="store_true", help="Select the orders of every series by grid search first")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Confidence interval level is 1 - alpha")
+    parser.add_argument("--workers", type=int, help="Number of worker processes (default: all cores)")
+    parser.add_argument("--out", default="forecasts.csv", help="Output file (.csv or .parquet)")
+    args = parser.parse_args(argv)
+
+    time_series_data = energy_data(args.start_date, args.end_date)
+
+    orders = None
+    if args.search:
+        series = {(group, area): frame[area].loc[frame[area].first_valid_index():frame[area].last_valid_index()]
+                  for group, frame in time_series_data.items() for area in frame.columns
+                  if frame[area].notna().any()}
+        leaderboard = grid_search_many(series, order_grid(s=args.seasonal_order[3]), max_workers=args.workers)
+        best = leaderboard[(leaderboard["rank"] == 1) & np.isfinite(leaderboard["aic"])]
+        orders = {row.series: (row.order, row.seasonal_order) for row in best.itertuples()}
+        for (group, area), (order, seasonal_order) in orders.items():
+            print(f"{group} {area}: order={order} seasonal_order={seasonal_order}")
+
+    df = forecast_all(time_series_data, args.horizon, tuple(args.order), tuple(args.seasonal_order),
+                      orders=orders, alpha=args.alpha, max_workers=args.workers)
+    export_forecasts(df, args.out)
+    print(f"Wrote {len(df)} forecast rows to {args.out}")
+    for group, area, error in df.attrs["failed"]:
+        print(f"Failed {group} {area}: {error}")
+
+
+if __name__ == "__main__":
+    main()
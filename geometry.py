@@ -0,0 +1,137 @@
+import json
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import shapely
+import streamlit as st
+
+# One shared cache of the NVE price area polygons (data/file.geojson).
+# The GeoJSON is read and reprojected once, and simplified variants for the
+# map zoom levels are persisted as GeoParquet next to each other, so folium
+# only receives the vertices that are visible at the zoom it is drawn at.
+
+GEOJSON_PATH = Path(__file__).parent / "data" / "file.geojson"
+GEOMETRY_DIR = Path(__file__).parent / "data" / "geometry"
+
+# Leaflet zoom -> simplification tolerance in degrees, about half a pixel
+ZOOM_TOLERANCES = {4: 0.05, 5: 0.02, 6: 0.01, 8: 0.0025, 10: 0.001}
+
+
+def tolerance_for(zoom) -> float:
+    """Tolerance of the closest zoom level at or below `zoom`. None or 0 is full resolution."""
+    if zoom is None:
+        return 0.0
+    levels = [level for level in ZOOM_TOLERANCES if level <= zoom]
+    if not levels:
+        return max(ZOOM_TOLERANCES.values())
+    if zoom > max(ZOOM_TOLERANCES):
+        return 0.0
+    return ZOOM_TOLERANCES[max(levels)]
+
+
+def variant_path(tolerance: float) -> Path:
+    return GEOMETRY_DIR / f"price_areas_{tolerance:g}.parquet"
+
+
+# The variants are only valid for the exact GeoJSON they were built from
+def source_signature() -> dict:
+    stat = os.stat(GEOJSON_PATH)
+    return {b"source_mtime_ns": str(stat.st_mtime_ns).encode(), b"source_size": str(stat.st_size).encode()}
+
+
+def read_geojson() -> gpd.GeoDataFrame:
+    gdf = gpd.read_file(GEOJSON_PATH)  # NVE Elspot Område
+    gdf = gdf.to_crs(4326)
+    gdf["area_id"] = gdf.index.astype(str)
+    return gdf
+
+
+def simplify_areas(gdf: gpd.GeoDataFrame, tolerance: float) -> gpd.GeoDataFrame:
+    """
+    Simplify the polygons without opening gaps or overlaps between
+    neighbouring areas (coverage simplification where GEOS supports it).
+    """
+    if tolerance <= 0:
+        return gdf
+    geometry = gdf.geometry
+    if hasattr(geometry, "simplify_coverage"):
+        simplified = geometry.simplify_coverage(tolerance)
+    else:
+        simplified = geometry.simplify(tolerance, preserve_topology=True)
+    return gdf.set_geometry(simplified)
+
+
+def read_variant(tolerance: float):
+    import pyarrow.parquet as pq
+
+    path = variant_path(tolerance)
+    if not path.exists():
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    if any(metadata.get(key) != value for key, value in source_signature().items()):
+        return None
+    return gpd.read_parquet(path)
+
+
+def write_variants(gdf: gpd.GeoDataFrame):
+    import pyarrow.parquet as pq
+
+    GEOMETRY_DIR.mkdir(parents=True, exist_ok=True)
+    signature = source_signature()
+    for tolerance in [0.0, *ZOOM_TOLERANCES.values()]:
+        path = variant_path(tolerance)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        simplify_areas(gdf, tolerance).to_parquet(tmp)
+        # Stamp the source signature into the GeoParquet schema metadata
+        table = pq.read_table(tmp)
+        table = table.replace_schema_metadata({**table.schema.metadata, **signature})
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+
+
+# Price areas in EPSG:4326, simplified for a map drawn at `zoom`
+# (None for full resolution, e.g. for point-in-polygon lookups)
+@st.cache_data
+def load_price_areas(zoom=None) -> gpd.GeoDataFrame:
+    tolerance = tolerance_for(zoom)
+    gdf = read_variant(tolerance)
+    if gdf is None:
+        full = read_geojson()
+        write_variants(full)
+        gdf = simplify_areas(full, tolerance)
+    return gdf
+
+
+# GeoJSON of the price areas for a map drawn at `zoom`, serialized only once.
+# Callers get their own copy, so they can add per-rerun properties to it.
+@st.cache_data
+def price_area_geojson(zoom=None) -> dict:
+    gdf = load_price_areas(zoom)[["area_id", "ElSpotOmr", "geometry"]]
+    return json.loads(gdf.to_json(drop_id=True))
+
+
+# Spatial index over the full-resolution polygons, shared by every session.
+# The polygons are prepared, so each containment test is cheap.
+@st.cache_resource
+def area_index():
+    gdf = load_price_areas()
+    geometries = np.asarray(gdf.geometry.values)
+    shapely.prepare(geometries)
+    return shapely.STRtree(geometries), gdf["ElSpotOmr"].to_numpy(dtype=object)
+
+
+def locate_many(lats, lons) -> np.ndarray:
+    """Price area (ElSpotOmr) of every point, None for points outside all areas."""
+    tree, names = area_index()
+    points = shapely.points(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+    point_idx, area_idx = tree.query(points, predicate="within")
+    areas = np.full(len(points), None, dtype=object)
+    areas[point_idx] = names[area_idx]
+    return areas
+
+
+def locate(lat: float, lon: float):
+    """Price area (ElSpotOmr) containing one coordinate, or None."""
+    return locate_many([lat], [lon])[0]
@@ -1,20 +1,275 @@
+import time
+
+import numpy as np
+import pandas as pd
 import streamlit as st
 import pymongo
 
+DATABASE = "elhub_data"
+CONSUMPTION_COLLECTION = "consumption_2021"
+
+# Time partitions of every dataset: (collection, first year, last year).
+# Years without an entry are routed to "<dataset>_<year>".
+PARTITIONS = {
+    "consumption": [("consumption_2021", 2021, 2021), ("consumption_2022_2024", 2022, 2024)],
+    "production": [("production_2021_2024", 2021, 2024)],
+}
+
+# Expressions for the keys the Elhub data can be grouped by.
+# Dates and hours are taken from starttime in UTC, like the pages did with pandas
+GROUP_KEYS = {
+    "pricearea": "$pricearea",
+    "consumptiongroup": "$consumptiongroup",
+    "productiongroup": "$productiongroup",
+    "year": {"$year": "$starttime"},
+    "month": {"$month": "$starttime"},
+    "day": {"$dayOfMonth": "$starttime"},
+    "hour": {"$hour": "$starttime"},
+}
+
 # Initialize connection.
 # Uses st.cache_resource to only run once.
 @st.cache_resource
 def init_connection():
     return pymongo.MongoClient(st.secrets["mongo"]["uri"])
 
-client = init_connection()
+def get_collection(name: str = CONSUMPTION_COLLECTION):
+    return init_connection()[DATABASE][name]
 
-# Pull data from the collection.
-# Uses st.cache_data to only rerun when the query changes or after 10 min.
 @st.cache_data(ttl=600)
-def get_data():
-    db = client['elhub_data']
-    collection = db['consumption_2021']
-    items = collection.find()
-    items = list(items)
-    return items
+def load_frame(collection=CONSUMPTION_COLLECTION, query=None, group_field="consumptiongroup",
+               batch_size=10_000) -> pd.DataFrame:
+    """
+    Stream the hourly Elhub rows into a typed DataFrame.
+
+    Only pricearea, the group field, starttime and quantitykwh are fetched.
+    The cursor is read in batches of `batch_size` documents, straight into
+    preallocated columns (datetime64 starttime, float32 kWh and categorical
+    area/group codes), so no list of row dicts is ever built.
+
+    The columns are sized without a counting pass over the collection: from
+    the collection metadata when all of it is read, otherwise one batch,
+    doubled whenever it is full and trimmed at the end.
+    """
+    query = query or {}
+    coll = get_collection(collection)
+    projection = {"_id": 0, "pricearea": 1, group_field: 1, "starttime": 1, "quantitykwh": 1}
+
+    n = coll.estimated_document_count() if not query else batch_size
+    starttime = np.empty(n, dtype="datetime64[ns]")
+    quantity = np.empty(n, dtype=np.float32)
+    area_codes = np.empty(n, dtype=np.int16)
+    group_codes = np.empty(n, dtype=np.int16)
+    areas, groups = {}, {}
+
+    i = 0
+    for doc in coll.find(query, projection=projection, batch_size=batch_size):
+        if i == len(quantity):
+            # The columns are full, grow them
+            size = max(2 * len(quantity), batch_size)
+            starttime, quantity, area_codes, group_codes = (
+                np.resize(col, size) for col in (starttime, quantity, area_codes, group_codes)
+            )
+        starttime[i] = doc["starttime"]
+        quantity[i] = doc["quantitykwh"]
+        area_codes[i] = areas.setdefault(doc["pricearea"], len(areas))
+        group_codes[i] = groups.setdefault(doc[group_field], len(groups))
+        i += 1
+
+    return pd.DataFrame({
+        "pricearea": pd.Categorical.from_codes(area_codes[:i], categories=list(areas)),
+        group_field: pd.Categorical.from_codes(group_codes[:i], categories=list(groups)),
+        "starttime": starttime[:i],
+        "quantitykwh": quantity[:i],
+    })
+
+def ensure_unique_index(collection, group_field="consumptiongroup"):
+    """Create the compound unique key (pricearea, group, starttime) if it does not exist."""
+    return collection.create_index(
+        [("pricearea", pymongo.ASCENDING), (group_field, pymongo.ASCENDING), ("starttime", pymongo.ASCENDING)],
+        unique=True,
+        name=f"pricearea_{group_field}_starttime_unique",
+    )
+
+def drop_duplicate_rows(collection, group_field="consumptiongroup") -> int:
+    """
+    Delete rows that share (pricearea, group, starttime) with another row,
+    keeping one of them. Needed once before the unique index can be created
+    on collections filled by the old insert-only notebooks.
+    """
+    pipeline = [
+        {"$group": {
+            "_id": {"pricearea": "$pricearea", "group": f"${group_field}", "starttime": "$starttime"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    extra_ids = [i for dup in collection.aggregate(pipeline, allowDiskUse=True) for i in dup["ids"][1:]]
+    if not extra_ids:
+        return 0
+    return collection.delete_many({"_id": {"$in": extra_ids}}).deleted_count
+
+def upsert_records(collection, records, group_field="consumptiongroup", batch_size=10_000) -> dict:
+    """
+    Idempotently write Elhub records keyed by (pricearea, group, starttime).
+
+    Records are sent as unordered bulk_write batches of upserts, so writing
+    the same month twice never duplicates rows. Returns the number of
+    inserted, updated, skipped (already identical) and failed rows, and the
+    throughput in rows per second. The unique index of ensure_unique_index
+    has to exist, which the caller sets up once per ingestion run.
+    """
+    stats = {"inserted": 0, "updated": 0, "skipped": 0, "failed": 0}
+    start = time.perf_counter()
+
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        operations = [
+            pymongo.UpdateOne(
+                {"pricearea": r["pricearea"], group_field: r[group_field], "starttime": r["starttime"]},
+                {"$set": r},
+                upsert=True,
+            )
+            for r in batch
+        ]
+        try:
+            result = collection.bulk_write(operations, ordered=False).bulk_api_result
+        except pymongo.errors.BulkWriteError as e:
+            # With ordered=False the rest of the batch is still written
+            result = e.details
+            stats["failed"] += len(result.get("writeErrors", []))
+        stats["inserted"] += result.get("nUpserted", 0)
+        stats["updated"] += result.get("nModified", 0)
+        stats["skipped"] += result.get("nMatched", 0) - result.get("nModified", 0)
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["rows_per_second"] = len(records) / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    return stats
+
+def group_field_for(dataset: str) -> str:
+    return "productiongroup" if dataset.startswith("production") else "consumptiongroup"
+
+def partition_for_year(dataset: str, year: int) -> str:
+    for name, first, last in PARTITIONS.get(dataset, []):
+        if first <= year <= last:
+            return name
+    return f"{dataset}_{year}"
+
+# Names of the collections that exist in the database, empty if MongoDB is unreachable
+@st.cache_data(ttl=600)
+def collection_names() -> list:
+    try:
+        return sorted(init_connection()[DATABASE].list_collection_names())
+    except pymongo.errors.PyMongoError:
+        return []
+
+def partitions_for(dataset: str, start, end) -> list:
+    """
+    Collections holding [start, end) of a dataset. The range is padded by a
+    day, since chunks were fetched in Norwegian local time and the first
+    hours of a year in UTC can live in the previous year's partition.
+
+    Years outside PARTITIONS are only routed to their "<dataset>_<year>"
+    collection if it exists, so ranges reaching past the ingested years do
+    not query (or build rollups for) collections that were never written.
+    """
+    configured = [name for name, _, _ in PARTITIONS.get(dataset, [])]
+    first = (pd.Timestamp(start) - pd.Timedelta(days=1)).year
+    last = (pd.Timestamp(end) + pd.Timedelta(days=1)).year
+    names = []
+    for year in range(first, last + 1):
+        name = partition_for_year(dataset, year)
+        if name in names or (name not in configured and name not in collection_names()):
+            continue
+        names.append(name)
+    return names
+
+def ensure_indexes(dataset: str, collections=None):
+    """
+    Create the compound indexes on every known partition of a dataset (or on
+    the given pymongo `collections`), so range queries for one area (and
+    group) are index scans:
+      - unique (pricearea, group, starttime), also used by upsert_records
+      - (pricearea, starttime) for queries over all groups of an area
+    """
+    group_field = group_field_for(dataset)
+    if collections is None:
+        collections = [get_collection(name) for name, _, _ in PARTITIONS.get(dataset, [])]
+    for collection in collections:
+        ensure_unique_index(collection, group_field)
+        collection.create_index(
+            [("pricearea", pymongo.ASCENDING), ("starttime", pymongo.ASCENDING)],
+            name="pricearea_starttime",
+        )
+
+def range_query(start, end, pricearea=None, groups=None, group_field="consumptiongroup") -> dict:
+    query = {"starttime": {"$gte": pd.Timestamp(start).to_pydatetime(), "$lt": pd.Timestamp(end).to_pydatetime()}}
+    if pricearea is not None:
+        query["pricearea"] = pricearea
+    if groups is not None:
+        query[group_field] = {"$in": list(groups)}
+    return query
+
+def find_hourly(dataset: str, start, end, pricearea=None, groups=None, batch_size=10_000) -> pd.DataFrame:
+    """Hourly rows of a dataset in [start, end), read from every partition the range spans."""
+    group_field = group_field_for(dataset)
+    query = range_query(start, end, pricearea, groups, group_field)
+    frames = [
+        load_frame(name, query=query, group_field=group_field, batch_size=batch_size)
+        for name in partitions_for(dataset, start, end)
+    ]
+    if not frames:
+        frames = [pd.DataFrame(columns=["pricearea", group_field, "starttime", "quantitykwh"])
+                  .astype({"starttime": "datetime64[ns]", "quantitykwh": "float32"})]
+    df = pd.concat(frames, ignore_index=True)
+    return df.astype({"pricearea": "category", group_field: "category"}).sort_values("starttime", ignore_index=True)
+
+def aggregate_hourly(dataset: str, by, start=None, end=None, pricearea=None, groups=None,
+                     collections=None) -> pd.DataFrame:
+    """
+    Sum quantitykwh by the `by` keys over [start, end), across all partitions
+    the range spans, or across the given pymongo `collections` only.
+    """
+    group_field = group_field_for(dataset)
+    pipeline = build_pipeline(by, pricearea, groups, start=start, end=end, group_field=group_field)
+    if collections is None:
+        collections = [get_collection(name) for name in partitions_for(dataset, start, end)]
+    rows = [row for collection in collections for row in collection.aggregate(pipeline)]
+    df = pd.DataFrame(rows, columns=[*by, "quantitykwh"])
+    # Keys without the year can appear in several partitions
+    return df.groupby(list(by), as_index=False)["quantitykwh"].sum()
+
+def build_pipeline(by, pricearea=None, groups=None, month=None, start=None, end=None,
+                   group_field="consumptiongroup") -> list:
+    """
+    Build an aggregation pipeline that filters on price area, groups, month
+    and a [start, end) starttime range, and sums quantitykwh per combination
+    of the `by` keys.
+    """
+    match = {}
+    if pricearea is not None:
+        match["pricearea"] = pricearea
+    if groups is not None:
+        match[group_field] = {"$in": list(groups)}
+    if start is not None or end is not None:
+        match["starttime"] = {}
+        if start is not None:
+            match["starttime"]["$gte"] = pd.Timestamp(start).to_pydatetime()
+        if end is not None:
+            match["starttime"]["$lt"] = pd.Timestamp(end).to_pydatetime()
+    if month is not None:
+        match["$expr"] = {"$eq": [{"$month": "$starttime"}, month]}
+
+    pipeline = [{"$match": match}] if match else []
+    pipeline.append({
+        "$group": {
+            "_id": {key: GROUP_KEYS[key] for key in by},
+            "quantitykwh": {"$sum": "$quantitykwh"},
+        }
+    })
+    pipeline.append({
+        "$project": {"_id": 0, "quantitykwh": 1, **{key: f"$_id.{key}" for key in by}}
+    })
+    pipeline.append({"$sort": {key: 1 for key in by}})
+    return pipeline
@@ -1,20 +1,15 @@
+import calendar
+
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from mongodb import get_data
+from rollups import load_rollup
 
 st.title("Electricity Consumption Analysis")
 
-# Load data from MongoDB
-items = get_data()
-df = pd.DataFrame(items)
-
-# Prepare the data
-df["starttime"] = pd.to_datetime(df["starttime"])
-df["endtime"] = pd.to_datetime(df["endtime"])
-df["month"] = df["starttime"].dt.month_name()
-df["hour"] = df["starttime"].dt.hour
+# Precomputed sums by (area, group, month) and (area, group, month, hour)
+monthly = load_rollup("monthly")
+monthly_hourly = load_rollup("monthly_hourly")
 
 col1, col2 = st.columns(2)
 
@@ -22,14 +17,16 @@ with col1:
     st.subheader("Consumption Distribution by Price Area")
 
     # Select pricearea as radio buttons
-    price_areas = sorted(df["pricearea"].unique())
+    price_areas = sorted(monthly.index.unique())
     selected_pricearea = st.radio("Select a Price Area:", price_areas)
 
-    # Filter by price area
-    df_area = df[df["pricearea"] == selected_pricearea]
-
     # Pie chart: consumption distribution by consumption group
-    pie_data = df_area.groupby("consumptiongroup")["quantitykwh"].sum().reset_index()
+    pie_data = (
+        monthly.loc[[selected_pricearea]]
+        .groupby("consumptiongroup", observed=True)["quantitykwh"]
+        .sum()
+        .reset_index()
+    )
     
     fig1 = px.pie(
         pie_data, 
@@ -44,25 +41,24 @@ with col2:
     st.subheader("Consumption Trend by Production Group")
 
     # Pills for selecting production groups
-    groups = sorted(df["consumptiongroup"].unique())
+    groups = sorted(monthly["consumptiongroup"].unique())
     selected_groups = st.multiselect(
         "Select Production Groups", groups, default=groups
     )
 
     # Month selection (dropdown)
-    months = sorted(df["month"].unique())
+    month_numbers = sorted(monthly["month"].unique())
+    months = [calendar.month_name[m] for m in month_numbers]
     selected_month = st.selectbox("Select Month:", months)
 
-    # Filter data based on all selections
-    df_filtered = df[
-        (df["pricearea"] == selected_pricearea)
-        & (df["consumptiongroup"].isin(selected_groups))
-        & (df["month"] == selected_month)
+    # Filter on all selections and group by hour for the line chart
+    df_area = monthly_hourly.loc[[selected_pricearea]]
+    df_filtered = df_area[
+        df_area["consumptiongroup"].isin(selected_groups)
+        & (df_area["month"] == month_numbers[months.index(selected_month)])
     ]
-
-    # Group by hour for line chart
     df_line = (
-        df_filtered.groupby(["hour", "consumptiongroup"])["quantitykwh"]
+        df_filtered.groupby(["hour", "consumptiongroup"], observed=True)["quantitykwh"]
         .sum()
         .reset_index()
     )
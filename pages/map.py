@@ -1,20 +1,19 @@
-import numpy as np
 import pandas as pd
-import geopandas as gpd
 import folium
 from streamlit_folium import st_folium
 from branca.colormap import linear
 import streamlit as st
-import streamlit as st
-import requests
-import pandas as pd
-import geopandas as gpd
 
 from Snow_drift import (
-    compute_yearly_results,
-    compute_average_sector,
+    assign_season,
+    compute_seasonal_transport,
     plot_rose,
 )
+from correlation import LAGS, best_lag, correlation_matrix
+from energy import ENERGY_GROUPS, energy_data, hourly_energy
+from geometry import load_price_areas, locate, price_area_geojson
+from utils import fetch_meteo
+from weather_schema import compact_weather, memory_saved
 
 # PAGE CONFIG
 st.set_page_config(page_title="Norwegian Power Price Dashboard", layout="wide")
@@ -26,28 +25,12 @@ st.markdown(
 )
 
 # DATA LOADING
-@st.cache_data
-def load_price_areas():
-    gdf = gpd.read_file("data/file.geojson")  # NVE Elspot Område
-    gdf = gdf.to_crs(4326)
-    gdf["area_id"] = gdf.index.astype(str)
-    return gdf
-
-@st.cache_data
-def load_municipalities():
-    gdf = gpd.read_file("data/file.geojson")
-    return gdf.to_crs(4326)
-
-@st.cache_data
-def load_geojson():
-    gdf = gpd.read_file("data/file.geojson")
-    gdf = gdf.to_crs(4326)
-    return gdf
-
+# Polygons come from the shared geometry cache: simplified for the zoom each
+# map is drawn at, full resolution for point lookups
+MAP_ZOOM = 5
+HIGHLIGHT_ZOOM = 6
 
-price_areas = load_price_areas()
-municipalities = load_municipalities()
-geojson_data = load_geojson()
+price_areas = load_price_areas(MAP_ZOOM)
 
 # ============================================================
 # USER DATE INPUTS (shared by energy, meteo, snow drift)
@@ -78,20 +61,10 @@ if start_date > end_date:
 
 
 
-# PLACEHOLDER DATA synced with user-selected date range
-energy_groups = ["Production", "Consumption"]
-time_index = pd.date_range(start=start_date, end=end_date, freq="D")
-days_available = len(time_index)
-
-np.random.seed(1)
-time_series_data = {
-    group: pd.DataFrame(
-        {area: np.random.uniform(10, 100, size=days_available)
-         for area in price_areas["ElSpotOmr"]},
-        index=time_index
-    )
-    for group in energy_groups
-}
+# ENERGY DATA for the user-selected date range (daily kWh per price area)
+energy_groups = ENERGY_GROUPS
+time_series_data = energy_data(start_date, end_date)
+days_available = len(time_series_data[energy_groups[0]])
 
 # USER INPUTS (full width at top)
 st.subheader("Options")
@@ -109,30 +82,23 @@ col_map, col_info = st.columns([2, 1])
 
 with col_map:
     st.subheader("Interactive Price Area Map")
-    colormap = linear.YlOrRd_09.scale(price_areas["value"].min(), price_areas["value"].max())
+    values = price_areas["value"].dropna()
+    if values.empty:
+        st.warning(f"No {selected_group} data in the selected date range.")
+    colormap = linear.YlOrRd_09.scale(values.min() if len(values) else 0, values.max() if len(values) else 1)
     colormap.caption = f"Mean {selected_group} over last {selected_days} days"
 
-    m = folium.Map(location=[64.5, 11], zoom_start=5, tiles="cartodbpositron")
+    # Areas without data are drawn grey
+    def fill_color(value):
+        return "#cccccc" if value is None or pd.isna(value) else colormap(value)
 
-    folium.GeoJson(
-        price_areas,
-        style_function=lambda f: {
-            "fillColor": colormap(f["properties"]["value"]),
-            "color": "#333333",
-            "weight": 1,
-            "fillOpacity": 0.5,
-        },
-        tooltip=folium.GeoJsonTooltip(
-            fields=["ElSpotOmr", "value"],
-            aliases=["Price Area", f"Mean {selected_group}"],
-        ),
-        name="Price Areas",
-    ).add_to(m)
-
-    colormap.add_to(m)
+    # The base map only holds static content (tiles, outlines, click popup), so it
+    # is identical on every rerun and stays mounted in the browser. Changing the
+    # group or interval only sends the small values layer below.
+    m = folium.Map(location=[64.5, 11], zoom_start=MAP_ZOOM, tiles="cartodbpositron")
 
     folium.GeoJson(
-        municipalities,
+        price_area_geojson(MAP_ZOOM),
         style_function=lambda f: {
             "fillColor": "transparent",
             "color": "#666666",
@@ -142,7 +108,38 @@ with col_map:
     ).add_to(m)
 
     m.add_child(folium.LatLngPopup())
-    map_data = st_folium(m, height=600, width="100%")
+
+    # Values layer: the simplified geometry with this rerun's means and colors
+    value_layer = folium.FeatureGroup(name="Price Areas")
+    value_geojson = price_area_geojson(MAP_ZOOM)
+    for feature in value_geojson["features"]:
+        value = mean_values.get(feature["properties"]["ElSpotOmr"])
+        feature["properties"]["value"] = None if pd.isna(value) else round(float(value), 1)
+
+    folium.GeoJson(
+        value_geojson,
+        style_function=lambda f: {
+            "fillColor": fill_color(f["properties"]["value"]),
+            "color": "#333333",
+            "weight": 1,
+            "fillOpacity": 0.5,
+        },
+        tooltip=folium.GeoJsonTooltip(
+            fields=["ElSpotOmr", "value"],
+            aliases=["Price Area", f"Mean {selected_group}"],
+        ),
+    ).add_to(value_layer)
+
+    map_data = st_folium(
+        m,
+        key="price_area_map",
+        feature_group_to_add=value_layer,
+        returned_objects=["last_clicked"],
+        height=600,
+        width="100%",
+    )
+    # The legend changes with the values, so it is drawn outside the map
+    st.html(colormap._repr_html_())
 
 with col_info:
     st.subheader("Selected Information")
@@ -153,17 +150,13 @@ with col_info:
         lat, lon = clicked_point["lat"], clicked_point["lng"]
         st.info(f"Selected coordinate: **({lat:.5f}, {lon:.5f})**")
 
-        point_gdf = gpd.GeoDataFrame(
-            geometry=gpd.points_from_xy([lon], [lat]), crs=4326
-        )
-        joined = gpd.sjoin(point_gdf, price_areas, how="left", predicate="within")
+        area_name = locate(lat, lon)
 
-        if not pd.isna(joined.iloc[0]["area_id"]):
-            selected_area = joined.iloc[0]
+        if area_name is not None:
+            selected_area = price_areas.loc[price_areas["ElSpotOmr"] == area_name].iloc[0]
             st.success(f"Location is inside **{selected_area['ElSpotOmr']}**")
 
             # Dynamic chart
-            area_name = selected_area["ElSpotOmr"]
             st.subheader(f"{selected_group} Evolution (Last {selected_days} Days)")
             st.line_chart(time_series_data[selected_group][area_name].tail(selected_days))
         else:
@@ -174,12 +167,13 @@ with col_info:
 # HIGHLIGHT SELECTED AREA MAP
 if selected_area is not None:
     st.subheader("Selected Price Area Highlight")
-    highlight_map = folium.Map(location=[lat, lon], zoom_start=6, tiles="cartodbpositron")
+    highlight_map = folium.Map(location=[lat, lon], zoom_start=HIGHLIGHT_ZOOM, tiles="cartodbpositron")
+    highlight_areas = load_price_areas(HIGHLIGHT_ZOOM).assign(value=price_areas["value"])
 
     folium.GeoJson(
-        price_areas,
+        highlight_areas,
         style_function=lambda f: {
-            "fillColor": colormap(f["properties"]["value"]),
+            "fillColor": fill_color(f["properties"]["value"]),
             "color": "#777777",
             "weight": 1,
             "fillOpacity": 0.5,
@@ -187,7 +181,7 @@ if selected_area is not None:
     ).add_to(highlight_map)
 
     # Highlight selected area with different outline
-    poly = price_areas.loc[price_areas["area_id"] == selected_area["area_id"], "geometry"].iloc[0]
+    poly = highlight_areas.loc[highlight_areas["area_id"] == selected_area["area_id"], "geometry"].iloc[0]
     folium.GeoJson(
         poly,
         style_function=lambda f: {
@@ -213,56 +207,13 @@ else:
     lon = 7.60
 
 
-# Extract polygon for the selected point
-point = gpd.GeoDataFrame(geometry=gpd.points_from_xy([lon], [lat]), crs=4326)
-selected_poly = gpd.sjoin(point, geojson_data, how="left", predicate="within")
-
-if selected_poly.empty:
+# Make sure the point is inside a price area
+if locate(lat, lon) is None:
     st.warning("Point is outside polygon dataset, using default coordinates.")
     lat, lon = 60.57, 7.60
 
 
 
-def fetch_meteo(lat, lon, start_date, end_date):
-    url = "https://archive-api.open-meteo.com/v1/era5"
-    params = {
-        "latitude": lat,
-        "longitude": lon,
-        "hourly": [
-            "temperature_2m",
-            "precipitation",
-            "wind_speed_10m",
-            "wind_direction_10m"
-        ],
-        "start_date": start_date,
-        "end_date": end_date,
-    }
-
-    r = requests.get(url, params=params).json()
-
-    # Safety check for API error
-    if "hourly" not in r:
-        raise ValueError(f"Open-Meteo error: {r}")
-
-    df = pd.DataFrame(r["hourly"])
-
-    # Convert time column
-    df["time"] = pd.to_datetime(df["time"])
-
-    # --- IMPORTANT: Rename into Snow Drift module naming ---
-    rename_map = {
-        "temperature_2m": "temperature_2m (°C)",
-        "precipitation": "precipitation (mm)",
-        "wind_speed_10m": "wind_speed_10m (m/s)",
-        "wind_direction_10m": "wind_direction_10m (°)"
-    }
-
-    # Only rename if columns exist (prevents KeyError)
-    df = df.rename(columns={k: v for k, v in rename_map.items() if k in df.columns})
-
-    return df
-
-
 # --- Snow Drift date inputs ---
 st.subheader("Snow Drift Date Range")
 
@@ -291,16 +242,17 @@ if start_date > end_date:
 # Fetch ERA5 data with user dates
 df = fetch_meteo(lat, lon, str(start_date), str(end_date))
 # Assign season (your function requires this)
-df["season"] = df["time"].apply(lambda dt: dt.year if dt.month >= 7 else dt.year - 1)
+df = compact_weather(assign_season(df))
+st.caption(f"Hourly weather in memory: {memory_saved(df)}")
 
 T = 3000
 F = 30000
 theta = 0.5
 
-yearly = compute_yearly_results(df, T, F, theta)
+yearly, sectors = compute_seasonal_transport(df, T, F, theta)
 overall = yearly["Qt (kg/m)"].mean()
 
-avg_sectors = compute_average_sector(df)
+avg_sectors = sectors.to_numpy().mean(axis=0)
 
 st.subheader("Snow Drift Results")
 st.write(yearly)
@@ -326,57 +278,28 @@ with col1:
 with col2:
     selected_energy = st.selectbox("Energy area", energy_columns)
 
-lag = st.slider("Lag (hours)", -72, 72, 0)
+lag = st.slider("Lag (hours)", int(LAGS[0]), int(LAGS[-1]), 0)
 window = st.slider("Window length (hours)", 6, 240, 48)
 
 
-# ---------- PREP METEO ----------
-met = (
-    df[["time", selected_meteo]]
-    .rename(columns={selected_meteo: "meteo"})
-    .set_index("time")
-)
-
-# Ensure strictly hourly
-met = met.resample("H").interpolate()
-
-
-# ---------- PREP ENERGY ----------
-energy_raw = time_series_data[selected_group][selected_energy]
-
-# Convert daily → hourly without destroying shape
-energy = (
-    energy_raw
-    .resample("H")
-    .ffill()      # Forward fill instead of interpolation
-)
-
-energy.name = "energy"
-
-
-# ---------- MERGE ----------
-merged = pd.concat([met, energy], axis=1).dropna()
-
-# Apply LAG
-if lag != 0:
-    merged["energy"] = merged["energy"].shift(lag)
+# ---------- LAG x TIME CORRELATION ----------
+# Computed for every lag at once and cached per window, so moving the lag
+# slider only selects a column
+met = df.set_index("time")[selected_meteo]
+energy = hourly_energy(selected_group, selected_energy, start_date, end_date)
+matrix = correlation_matrix(met, energy, window)
 
-merged = merged.dropna()
-
-# Debug output if needed
-if merged.empty:
+if matrix.empty:
     st.error("Merged meteorology & energy dataset is empty — timestamps don’t overlap.")
     st.write("Meteo index example:", met.head())
     st.write("Energy index example:", energy.head())
     st.stop()
 
-
-# ---------- SLIDING CORRELATION ----------
-corr = merged["meteo"].rolling(window).corr(merged["energy"])
+corr = matrix[lag]
 
 if corr.dropna().empty:
     st.error("Correlation series is empty — window too large or lag misaligned.")
-    st.write("Merged shape:", merged.shape)
+    st.write("Merged shape:", matrix.shape)
     st.write("Correlation head:", corr.head())
     st.stop()
 
@@ -403,11 +326,44 @@ fig.update_layout(
 
 st.plotly_chart(fig, use_container_width=True)
 
+
+# ---------- LAG HEATMAP ----------
+# Daily means keep the heatmap small enough for the browser
+daily = matrix.resample("D").mean()
+best = best_lag(daily)
+
+fig = go.Figure()
+fig.add_trace(go.Heatmap(
+    x=daily.index,
+    y=daily.columns,
+    z=daily.to_numpy().T,
+    zmin=-1,
+    zmax=1,
+    colorscale="RdBu_r",
+    colorbar=dict(title="Correlation"),
+))
+fig.add_trace(go.Scatter(
+    x=best.index,
+    y=best["lag"],
+    mode="markers",
+    marker=dict(color="black", size=3),
+    name="Best lag",
+))
+
+fig.update_layout(
+    title=f"Correlation by Lag: {selected_meteo} ↔ {selected_energy} ({window} h window)",
+    xaxis_title="Time",
+    yaxis_title="Lag (hours)",
+    template="plotly_white",
+    height=450
+)
+
+st.plotly_chart(fig, use_container_width=True)
+
 # ============================================================
 # STORE SHARED DATA FOR OTHER PAGES
 # ============================================================
 
-st.session_state["time_series_data"] = time_series_data
 st.session_state["df"] = df                 # meteo dataframe
 st.session_state["energy_groups"] = energy_groups
 st.session_state["price_areas"] = price_areas
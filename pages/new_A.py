@@ -1,28 +1,38 @@
 import streamlit as st
 import pandas as pd
-from utils import save_data, decompose_production_stl, plot_production_spectrogram
+from utils import save_data_bulk, decompose_production_stl, plot_production_spectrogram
 
 st.title("New A – Time Series Decomposition & Spectrogram")
 
-# --- Input for location and year ---
-col1, col2, col3 = st.columns(3)
-with col1:
-    latitude = st.number_input("Latitude", value=59.91)
-with col2:
-    longitude = st.number_input("Longitude", value=10.75)
-with col3:
-    year = st.number_input("Year", min_value=1979, max_value=2025, value=2023, step=1)
+# --- Input for locations and years ---
+sites = st.data_editor(
+    pd.DataFrame({"latitude": [59.91], "longitude": [10.75]}),
+    num_rows="dynamic",
+    key="sites",
+)
+years = st.slider("Years", min_value=1979, max_value=2025, value=(2023, 2023))
 
 # --- Fetch data and store in session state ---
+# All site-years are fetched concurrently
 if st.button("Fetch Data"):
-    df = save_data(latitude, longitude, year)
-    df["date"] = pd.to_datetime(df["date"])
+    locations = list(sites.dropna().itertuples(index=False, name=None))
+    if not locations:
+        st.error("Add at least one site.")
+        st.stop()
+    bar = st.progress(0.0)
+    df = save_data_bulk(
+        locations,
+        list(range(years[0], years[1] + 1)),
+        progress=lambda done, total: bar.progress(done / total, text=f"{done}/{total} site-years"),
+    )
     st.session_state["df"] = df
-    st.success(f"Data fetched for {latitude}°, {longitude}° in {year}!")
+    st.success(f"Data fetched for {len(locations)} site(s) in {years[0]}–{years[1]}!")
 
-# --- Use dataframe from session state if available ---
 if "df" in st.session_state:
     df = st.session_state["df"]
+    if "location" in df.columns:
+        location = st.selectbox("Site", df["location"].unique())
+        df = df[df["location"] == location]
 
     tab1, tab2 = st.tabs(["STL Analysis", "Spectrogram"])
 
@@ -1,25 +1,36 @@
 import streamlit as st
 import pandas as pd
-from utils import save_data, detect_temperature_outliers, detect_precipitation_anomalies
+from utils import save_data_bulk, detect_temperature_outliers, detect_precipitation_anomalies
 
 st.title("New B – Outlier & Anomaly Analysis")
 
-col1, col2, col3 = st.columns(3)
-with col1:
-    latitude = st.number_input("Latitude", value=59.91)
-with col2:
-    longitude = st.number_input("Longitude", value=10.75)
-with col3:
-    year = st.number_input("Year", min_value=1979, max_value=2025, value=2023, step=1)
+sites = st.data_editor(
+    pd.DataFrame({"latitude": [59.91], "longitude": [10.75]}),
+    num_rows="dynamic",
+    key="sites",
+)
+years = st.slider("Years", min_value=1979, max_value=2025, value=(2023, 2023))
 
+# All site-years are fetched concurrently
 if st.button("Fetch Data"):
-    df = save_data(latitude, longitude, year)
-    df["date"] = pd.to_datetime(df["date"])
+    locations = list(sites.dropna().itertuples(index=False, name=None))
+    if not locations:
+        st.error("Add at least one site.")
+        st.stop()
+    bar = st.progress(0.0)
+    df = save_data_bulk(
+        locations,
+        list(range(years[0], years[1] + 1)),
+        progress=lambda done, total: bar.progress(done / total, text=f"{done}/{total} site-years"),
+    )
     st.session_state["df"] = df
-    st.success(f"Data fetched for {latitude}°, {longitude}° in {year}!")
+    st.success(f"Data fetched for {len(locations)} site(s) in {years[0]}–{years[1]}!")
 
 if "df" in st.session_state:
     df = st.session_state["df"]
+    if "location" in df.columns:
+        location = st.selectbox("Site", df["location"].unique())
+        df = df[df["location"] == location]
     tab1, tab2 = st.tabs(["Outlier / SPC", "Anomaly / LOF"])
 
     with tab1:
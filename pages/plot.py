@@ -30,5 +30,5 @@ month_nr = get_month_number(selected_month)
 filtered_df = filter_by_month(data_df, month_nr)
 
 # Display data for every day in the selected month
-chart_data = filtered_df.set_index('time_str')[option]
+chart_data = filtered_df[option]
 st.line_chart(chart_data, height=600)
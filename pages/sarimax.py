@@ -4,15 +4,16 @@ from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 import plotly.io as pio
 import pandas as pd
-import numpy as np
 import plotly.graph_objects as go
-import requests
-from statsmodels.tsa.statespace.sarimax import SARIMAX
+from energy import AREAS, daily_energy, energy_data
+from features import climatology, daily_weather, exog_matrix, feature_columns, future_exog
+from forecasting import backtest, forecast_all, get_results, grid_search, model_key, order_grid
+from utils import extend_meteo
 
 
 # 1. VALIDATE REQUIRED DATA
 required_keys = [
-    "time_series_data", "df", "energy_groups", "price_areas",
+    "df", "energy_groups", "price_areas",
     "selected_group", "selected_area", "lat", "lon",
     "start_date", "end_date"
 ]
@@ -23,7 +24,6 @@ for key in required_keys:
         st.stop()
 
 # 2. FETCH VARIABLES FROM SESSION_STATE
-time_series_data = st.session_state["time_series_data"]
 df_meteo = st.session_state["df"]
 energy_groups = st.session_state["energy_groups"]
 price_areas = st.session_state["price_areas"]
@@ -35,53 +35,16 @@ lon = st.session_state["lon"]
 start_date = st.session_state["start_date"]
 end_date = st.session_state["end_date"]
 
-# --- HELPER FUNCTION TO FETCH WEATHER DATA ---
-def fetch_weather(lat, lon, start_date, end_date, variables=None):
-    """
-    Fetch hourly weather data from Open-Meteo API.
-    Returns a dataframe with columns for the requested variables.
-    """
-    if variables is None:
-        variables = ["temperature_2m", "precipitation", "wind_speed_10m", "wind_direction_10m"]
-
-    url = "https://archive-api.open-meteo.com/v1/era5"
-    params = {
-        "latitude": lat,
-        "longitude": lon,
-        "hourly": variables,
-        "start_date": str(start_date),
-        "end_date": str(end_date),
-    }
-
-    r = requests.get(url, params=params).json()
-    if "hourly" not in r:
-        raise ValueError(f"Open-Meteo error: {r}")
-
-    df = pd.DataFrame(r["hourly"])
-    df["time"] = pd.to_datetime(df["time"])
-
-    # Rename to match existing format
-    rename_map = {
-        "temperature_2m": "temperature_2m (°C)",
-        "precipitation": "precipitation (mm)",
-        "wind_speed_10m": "wind_speed_10m (m/s)",
-        "wind_direction_10m": "wind_direction_10m (°)"
-    }
-    df = df.rename(columns={k: v for k, v in rename_map.items() if k in df.columns})
-
-    return df
-
 st.title("🔮 SARIMAX Forecasting – Energy Production & Consumption")
 
 # 1. VALIDATE REQUIRED DATA (from main app)
-required_keys = ["time_series_data", "df", "energy_groups", "price_areas"]
+required_keys = ["df", "energy_groups", "price_areas"]
 
 for key in required_keys:
     if key not in st.session_state:
         st.error(f"Missing `{key}` in session_state. Load map and snowdrift page first.")
         st.stop()
 
-time_series_data = st.session_state["time_series_data"]
 df_meteo = st.session_state["df"]
 energy_groups = st.session_state["energy_groups"]
 price_areas = st.session_state["price_areas"]
@@ -97,8 +60,8 @@ with col1:
 with col2:
     selected_area = st.selectbox(
         "Price area",
-        list(time_series_data[selected_group].columns),
-        index=list(time_series_data[selected_group].columns).index(selected_area) if selected_area in time_series_data[selected_group].columns else 0
+        AREAS,
+        index=AREAS.index(selected_area) if selected_area in AREAS else 0
     )
 
 with col3:
@@ -128,20 +91,13 @@ lat = st.session_state["lat"]
 lon = st.session_state["lon"]
 
 
-# Fetch weather data if missing or outside training range
-if "df" not in st.session_state \
-        or st.session_state["df"].empty \
-        or st.session_state["df"]["time"].min() > pd.to_datetime(train_start) \
-        or st.session_state["df"]["time"].max() < pd.to_datetime(train_end):
-
-    st.info("Fetching weather data for the selected period...")
-    df_meteo = fetch_weather(lat, lon, train_start, train_end)
-    st.session_state["df"] = df_meteo
-else:
-    df_meteo = st.session_state["df"]
+# Fetch only the part of the training range that is not already loaded
+df_meteo = extend_meteo(st.session_state.get("df"), lat, lon, train_start, train_end)
+st.session_state["df"] = df_meteo
 
-# Prepare list of weather variables for selection
-meteo_columns = [c for c in df_meteo.columns if c not in ["time", "season"]]
+# Resample the weather to days once; derived features and lags are built from it
+daily_meteo = daily_weather(df_meteo)
+meteo_columns = feature_columns(daily_meteo)
 
 selected_exog = st.multiselect(
     "Select weather variables for SARIMAX",
@@ -152,55 +108,84 @@ selected_exog = st.multiselect(
 # 4. SARIMAX PARAMETERS
 st.subheader("SARIMAX Parameters")
 
+# The orders are kept in session_state, so the automatic order selection below
+# can fill them in
+for key, default in {"p": 1, "d": 1, "q": 1, "P": 0, "D": 1, "Q": 1, "s": 7}.items():
+    st.session_state.setdefault(f"sarimax_{key}", default)
+
 with st.expander("Show SARIMAX settings"):
     col_p, col_d, col_q = st.columns(3)
-    p = col_p.number_input("p (AR)", value=1, min_value=0, max_value=5)
-    d = col_d.number_input("d (Diff)", value=1, min_value=0, max_value=2)
-    q = col_q.number_input("q (MA)", value=1, min_value=0, max_value=5)
+    p = col_p.number_input("p (AR)", min_value=0, max_value=5, key="sarimax_p")
+    d = col_d.number_input("d (Diff)", min_value=0, max_value=2, key="sarimax_d")
+    q = col_q.number_input("q (MA)", min_value=0, max_value=5, key="sarimax_q")
 
     col_P, col_D, col_Q, col_s = st.columns(4)
-    P = col_P.number_input("P (Seasonal AR)", value=0, min_value=0, max_value=5)
-    D = col_D.number_input("D (Seasonal Diff)", value=1, min_value=0, max_value=2)
-    Q = col_Q.number_input("Q (Seasonal MA)", value=1, min_value=0, max_value=5)
-    s = col_s.number_input("Seasonal period (s)", value=7, min_value=1, max_value=365)
+    P = col_P.number_input("P (Seasonal AR)", min_value=0, max_value=5, key="sarimax_P")
+    D = col_D.number_input("D (Seasonal Diff)", min_value=0, max_value=2, key="sarimax_D")
+    Q = col_Q.number_input("Q (Seasonal MA)", min_value=0, max_value=5, key="sarimax_Q")
+    s = col_s.number_input("Seasonal period (s)", min_value=1, max_value=365, key="sarimax_s")
 
 
 # 5. PREPARE DATA
-energy_series = time_series_data[selected_group][selected_area]
-energy_series = energy_series.loc[str(train_start):str(train_end)]
+energy_series = daily_energy(selected_group, train_start, train_end)[selected_area]
 
-if energy_series.empty:
+if energy_series.isna().all():
     st.error("Selected training window has no data.")
     st.stop()
 
 # Exogenous 
 if selected_exog:
-    df_m = df_meteo.set_index("time")[selected_exog]
-    df_m = df_m.resample("D").mean()
-    df_m = df_m.reindex(energy_series.index).interpolate()
-    exog_train = df_m
+    exog_train = exog_matrix(daily_meteo, tuple(selected_exog), energy_series.index[0], energy_series.index[-1])
 else:
     exog_train = None
 
 
+# AUTOMATIC ORDER SELECTION
+# Runs as a button callback, so the best orders are set before the
+# parameter widgets are drawn on the next rerun
+def search_orders(series, exog):
+    st.session_state.pop("sarimax_search_error", None)
+    try:
+        leaderboard, _ = grid_search(series, order_grid(s=st.session_state["sarimax_s"]), exog)
+    except Exception as e:
+        st.session_state["sarimax_search_error"] = f"Order search failed: {e}"
+        st.session_state.pop("sarimax_leaderboard", None)
+        return
+    best = leaderboard.iloc[0]
+    for key, value in zip("pdq", best["order"]):
+        st.session_state[f"sarimax_{key}"] = int(value)
+    for key, value in zip("PDQ", best["seasonal_order"]):
+        st.session_state[f"sarimax_{key}"] = int(value)
+    st.session_state["sarimax_leaderboard"] = leaderboard
+
+with st.expander("Automatic order selection"):
+    st.write("Chooses d and D with a KPSS test and the STL seasonal strength, then fits a grid "
+             "of candidate orders in parallel, prunes the clearly worse ones after a few "
+             "iterations and ranks the rest by AIC.")
+    st.button("Search orders", on_click=search_orders, args=(energy_series, exog_train))
+    if "sarimax_search_error" in st.session_state:
+        st.error(st.session_state["sarimax_search_error"])
+    if "sarimax_leaderboard" in st.session_state:
+        st.dataframe(st.session_state["sarimax_leaderboard"].head(20), use_container_width=True)
+
+
 # 6. FIT SARIMAX
 st.subheader("Run Forecast")
 
+# Fitted models come from the shared registry. Once trained, the forecast is
+# shown on every rerun with the same model, so changing the horizon or
+# downloading a file does not refit
+order = (p, d, q)
+seasonal_order = (P, D, Q, s)
+current_model = model_key(energy_series, order, seasonal_order, exog_train)
 
-# --- AFTER YOUR FORECAST AND PLOT ---
 if st.button("Train & Forecast"):
+    st.session_state["sarimax_model"] = current_model
 
-    try:
-        model = SARIMAX(
-            energy_series,
-            order=(p, d, q),
-            seasonal_order=(P, D, Q, s),
-            exog=exog_train,
-            enforce_stationarity=False,
-            enforce_invertibility=False,
-        )
+if st.session_state.get("sarimax_model") == current_model:
 
-        results = model.fit()
+    try:
+        results = get_results(energy_series, order, seasonal_order, exog_train)
         st.success("Model successfully trained.")
         st.write(results.summary())
 
@@ -211,9 +196,9 @@ if st.button("Train & Forecast"):
             freq="D"
         )
 
+        # Future weather is not known, use the day-of-year climatology of the location
         if selected_exog:
-            exog_future = df_meteo.set_index("time")[selected_exog].resample("D").mean()
-            exog_future = exog_future.reindex(future_index, method="ffill")
+            exog_future = future_exog(daily_meteo, selected_exog, future_index, climatology(lat, lon))
         else:
             exog_future = None
 
@@ -266,3 +251,61 @@ if st.button("Train & Forecast"):
 
     except Exception as e:
         st.error(f"SARIMAX failed: {e}")
+
+
+# 7. BATCH FORECAST
+# Every group and price area with the orders above, fitted in parallel processes.
+# The same job runs from the command line with `python forecasting.py`
+st.subheader("Forecast All Areas and Groups")
+
+if st.button("Forecast all"):
+    with st.spinner("Fitting all series..."):
+        st.session_state["sarimax_batch"] = forecast_all(
+            energy_data(train_start, train_end), forecast_horizon, order, seasonal_order
+        )
+
+if "sarimax_batch" in st.session_state:
+    batch = st.session_state["sarimax_batch"]
+    for group, area, error in batch.attrs.get("failed", []):
+        st.warning(f"No forecast for {group} in {area}: {error}")
+    st.dataframe(batch, use_container_width=True)
+    st.download_button(
+        label="📥 Download All Forecasts (CSV)",
+        data=batch.to_csv(index=False),
+        file_name="sarimax_forecasts.csv",
+        mime="text/csv"
+    )
+
+
+# 8. BACKTEST
+# Rolling-origin evaluation of the orders above on the training window. The
+# model is fitted once and only re-filtered at every origin
+st.subheader("Backtest")
+
+col_h, col_step, col_window = st.columns(3)
+with col_h:
+    backtest_horizon = st.number_input("Backtest horizon (days)", min_value=1, max_value=90, value=14)
+with col_step:
+    backtest_step = st.number_input("Days between origins", min_value=1, max_value=90, value=7)
+with col_window:
+    backtest_window = st.selectbox("Training window", ["expanding", "sliding"])
+
+if st.button("Run backtest"):
+    try:
+        with st.spinner("Backtesting..."):
+            st.session_state["sarimax_backtest"] = backtest(
+                energy_series, order, seasonal_order, exog_train,
+                horizon=backtest_horizon, step=backtest_step, window=backtest_window,
+            )
+    except Exception as e:
+        st.error(f"Backtest failed: {e}")
+
+if "sarimax_backtest" in st.session_state:
+    metrics, backtest_forecasts = st.session_state["sarimax_backtest"]
+    st.write(f"{backtest_forecasts['origin'].nunique()} forecast origins")
+    st.dataframe(metrics, use_container_width=True)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=metrics.index, y=metrics["MAE"], mode="lines+markers", name="MAE"))
+    fig.update_layout(title="Backtest MAE by Forecast Horizon", xaxis_title="Horizon (days)", yaxis_title="MAE", template="plotly_white", height=400)
+    st.plotly_chart(fig, use_container_width=True)
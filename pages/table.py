@@ -19,7 +19,7 @@ month_nr = get_month_number(selected_month)
 filtered_df = filter_by_month(data_df, month_nr)
 
 # Switch the rows and columns, and turn all of the entries into a list
-data_transposed = filtered_df.drop(['time', 'time_str'], axis=1).T
+data_transposed = filtered_df.T
 data_transposed['combined'] = data_transposed.values.tolist()
 
 # Plot the transposed dataframe with the list valies
@@ -1,27 +1,135 @@
+import importlib.util
+import os
+import time
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 import streamlit as st
 
-# Read the csv file and convert the date to datetime format so we can process it later
+# Explicit dtypes for the open-meteo csv export, so nothing has to be inferred
+CSV_DTYPES = {
+    "temperature_2m (°C)": "float32",
+    "precipitation (mm)": "float32",
+    "wind_speed_10m (m/s)": "float32",
+    "wind_gusts_10m (m/s)": "float32",
+    "wind_direction_10m (°)": "uint16",
+}
+
+# The pyarrow csv parser is multi-threaded and much faster than the default one
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+CSV_ENGINE = "pyarrow" if HAS_PYARROW else "c"
+
+# Temporary sidecar files older than this were left by a writer that crashed
+STALE_TMP_SECONDS = 600
+
+# Read the csv file into a frame indexed by time, with the row ranges of every
+# month precomputed so filtering by month is a slice lookup.
+# The parsed frame is kept in an uncompressed Feather sidecar next to the csv,
+# which every process can memory map instead of parsing the text again.
+# The sidecar is only a cache: if it cannot be read or written (corrupt file,
+# read-only checkout) the csv is parsed as before
 @st.cache_data
 def read_csv_file(filepath: str) -> pd.DataFrame:
-    df = pd.read_csv(f"{filepath}")
+    df = None
+    if HAS_PYARROW:
+        try:
+            df = read_sidecar(filepath)
+        except (OSError, ValueError):  # truncated or corrupt sidecar
+            df = None
+    if df is None:
+        df = parse_csv_file(filepath)
+        if HAS_PYARROW:
+            write_sidecar(filepath, df)
 
-    df['time'] = pd.to_datetime(df['time'], format='%Y-%m-%dT%H:%M')
-    df['time_str'] = df['time'].apply(str)
+    df.attrs["month_partitions"] = month_partitions(df.index)
 
     return df
 
+def parse_csv_file(filepath: str) -> pd.DataFrame:
+    df = pd.read_csv(
+        f"{filepath}",
+        dtype=CSV_DTYPES,
+        parse_dates=['time'],
+        date_format='%Y-%m-%dT%H:%M',
+        engine=CSV_ENGINE,
+    )
+    return df.set_index('time').sort_index()
+
+def sidecar_path(filepath: str) -> Path:
+    return Path(filepath).with_suffix(".feather")
+
+# The sidecar is only valid for the exact csv it was built from
+def source_signature(filepath: str) -> dict:
+    stat = os.stat(filepath)
+    return {b"source_mtime_ns": str(stat.st_mtime_ns).encode(), b"source_size": str(stat.st_size).encode()}
+
+# Memory map the sidecar read-only. Returns None if it is missing or stale
+def read_sidecar(filepath: str):
+    import pyarrow.feather as feather
+
+    path = sidecar_path(filepath)
+    if not path.exists():
+        return None
+    table = feather.read_table(path, memory_map=True)
+    metadata = table.schema.metadata or {}
+    signature = source_signature(filepath)
+    if any(metadata.get(key) != value for key, value in signature.items()):
+        return None
+    return table.to_pandas(split_blocks=True)
+
+# Write through a temporary file, so other processes never map a partial sidecar.
+# Failures (e.g. a read-only data directory) are ignored, the sidecar is optional
+def write_sidecar(filepath: str, df: pd.DataFrame):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    table = pa.Table.from_pandas(df)
+    table = table.replace_schema_metadata({**table.schema.metadata, **source_signature(filepath)})
+    path = sidecar_path(filepath)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        for stale in path.parent.glob(f"{path.stem}.*.tmp"):
+            if time.time() - stale.stat().st_mtime > STALE_TMP_SECONDS:
+                stale.unlink(missing_ok=True)
+        feather.write_feather(table, tmp, compression="uncompressed")
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            tmp.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+# Map month number (1-12) to the rows of that month. Months are contiguous in a
+# sorted index spanning at most one year, so they are stored as slices there
+def month_partitions(index: pd.DatetimeIndex) -> dict:
+    months = index.month.to_numpy()
+    partitions = {}
+    for month in range(1, 13):
+        positions = np.flatnonzero(months == month)
+        if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+            partitions[month] = slice(int(positions[0]), int(positions[-1]) + 1)
+        else:
+            partitions[month] = positions
+    return partitions
+
 # Filter dataframe by month number (1-12). If month is 0 the entire year is returned
 def filter_by_month(df: pd.DataFrame, month: int) -> pd.DataFrame:
     if month == 0:
         return df
-    return df[df['time'].dt.month == month]
+    partitions = df.attrs.get("month_partitions")
+    if partitions is None:
+        return df[df.index.month == month]
+    month_df = df.iloc[partitions[month]]
+    # The partitions describe the full frame, not the filtered one
+    month_df.attrs.pop("month_partitions", None)
+    return month_df
 
 def get_month_options() -> list:
     return [
         "All Months",
         "January",
-        "February", 
+        "February",
         "March",
         "April",
         "May",
@@ -0,0 +1,132 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+from pymongo.errors import PyMongoError
+
+from mongodb import CONSUMPTION_COLLECTION, aggregate_hourly, get_collection, group_field_for
+
+# Precomputed rollups of the hourly Elhub data, stored as local Parquet files.
+# Pages read these small cube tables instead of grouping the raw hourly rows.
+
+ROLLUP_DIR = Path(__file__).parent / "data" / "rollups"
+
+# Rollup name -> time keys. Every rollup is also keyed by price area and group.
+ROLLUPS = {
+    "monthly": ("year", "month"),
+    "monthly_hourly": ("year", "month", "hour"),
+    "daily": ("year", "month", "day"),
+}
+
+
+def rollup_path(collection: str, name: str) -> Path:
+    return ROLLUP_DIR / collection / f"{name}.parquet"
+
+
+# A rollup is only valid for the collection state it was built from. The
+# document count is cheap to read and changes whenever hours are inserted.
+def source_signature(source) -> dict:
+    return {b"document_count": str(source.estimated_document_count()).encode()}
+
+
+def compute_rollup(collection: str, name: str, start=None, end=None, source=None) -> pd.DataFrame:
+    """
+    Aggregate one rollup on the MongoDB server, optionally for a [start, end)
+    range only. `source` is the pymongo collection to read, by default the
+    collection named `collection` on the app's connection.
+    """
+    source = source if source is not None else get_collection(collection)
+    group_field = group_field_for(collection)
+    by = ("pricearea", group_field, *ROLLUPS[name])
+    df = aggregate_hourly(collection, by, start, end, collections=[source])
+    return df.astype({"pricearea": "category", group_field: "category", "quantitykwh": "float64"})
+
+
+def save_rollup(collection: str, name: str, df: pd.DataFrame, signature: dict):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = rollup_path(collection, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, **signature})
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+
+def read_rollup(collection: str, name: str, source):
+    """
+    The stored rollup, or None if it is missing or older than the collection.
+    While MongoDB cannot be reached, an existing rollup is always served.
+    """
+    import pyarrow.parquet as pq
+
+    path = rollup_path(collection, name)
+    if not path.exists():
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    try:
+        signature = source_signature(source)
+    except PyMongoError:
+        # MongoDB is unreachable, the stored rollup is the best there is
+        return pd.read_parquet(path)
+    if any(metadata.get(key) != value for key, value in signature.items()):
+        return None
+    return pd.read_parquet(path)
+
+
+def build_rollups(collection: str = CONSUMPTION_COLLECTION, source=None):
+    """Build every rollup for a collection from scratch."""
+    source = source if source is not None else get_collection(collection)
+    # Taken before aggregating, so rows written meanwhile make the rollups stale
+    signature = source_signature(source)
+    for name in ROLLUPS:
+        save_rollup(collection, name, compute_rollup(collection, name, source=source), signature)
+
+
+def update_rollups(collection: str, starttimes, source=None):
+    """
+    Update the rollups after new hours have been ingested.
+
+    Only the months touched by `starttimes` are re-aggregated from MongoDB
+    and replaced in the rollups, so re-ingesting the same hours never counts
+    them twice. Rollups that were never built (or predate the signature) are
+    built in full instead, since there is nothing to merge the months into.
+    """
+    import pyarrow.parquet as pq
+
+    months = pd.DatetimeIndex(pd.to_datetime(starttimes)).tz_localize(None).to_period("M").unique()
+    if months.empty:
+        return
+    start = months.min().start_time
+    end = (months.max() + 1).start_time
+
+    source = source if source is not None else get_collection(collection)
+    signature = source_signature(source)
+    for name in ROLLUPS:
+        path = rollup_path(collection, name)
+        if not path.exists() or b"document_count" not in (pq.read_schema(path).metadata or {}):
+            save_rollup(collection, name, compute_rollup(collection, name, source=source), signature)
+            continue
+        old = pd.read_parquet(path)
+        old_months = pd.PeriodIndex.from_fields(year=old["year"], month=old["month"], freq="M")
+        stale = (old_months >= months.min()) & (old_months <= months.max())
+        fresh = compute_rollup(collection, name, start, end, source=source)
+        fresh = pd.concat([old[~stale], fresh], ignore_index=True)
+        fresh = fresh.astype({"pricearea": "category", fresh.columns[1]: "category"})
+        fresh = fresh.sort_values(list(fresh.columns[:-1])).reset_index(drop=True)
+        save_rollup(collection, name, fresh, signature)
+
+
+# Rollups are indexed by price area, so a page lookup is an index access.
+# Missing rollups, and rollups built before rows were added to the collection
+# (e.g. the empty ones of a partition that had no data yet), are rebuilt.
+@st.cache_data(ttl=600)
+def load_rollup(name: str, collection: str = CONSUMPTION_COLLECTION) -> pd.DataFrame:
+    df = read_rollup(collection, name, get_collection(collection))
+    if df is None:
+        build_rollups(collection)
+        df = pd.read_parquet(rollup_path(collection, name))
+    return df.set_index("pricearea").sort_index()
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import correlation
+
+
+def rolling_corr(x, y, lag, window):
+    return pd.Series(x).rolling(window).corr(pd.Series(y).shift(lag)).to_numpy()
+
+
+@pytest.fixture
+def series():
+    """Two weeks of hourly data where y follows x with a 6 hour delay."""
+    rng = np.random.default_rng(42)
+    n = 24 * 14
+    x = np.sin(np.arange(n) * 2 * np.pi / 24) + rng.normal(0, 0.5, n)
+    y = np.roll(x, 6) + rng.normal(0, 0.5, n) + 100
+    return x, y
+
+
+@pytest.mark.parametrize("window", [24, 48, 168])
+def test_rolling_lag_correlation_matches_pandas(series, window):
+    x, y = series
+    lags = np.array([-24, -6, -1, 0, 1, 6, 24])
+    result = correlation.rolling_lag_correlation(x, y, lags, (window,))[window]
+    assert result.shape == (len(lags), len(x))
+    for i, lag in enumerate(lags):
+        np.testing.assert_allclose(result[i], rolling_corr(x, y, lag, window), atol=1e-5, equal_nan=True)
+
+
+def test_rolling_lag_correlation_with_nans(series):
+    x, y = series
+    x, y = x.copy(), y.copy()
+    x[[10, 100, 101]] = np.nan
+    y[[50, 200]] = np.nan
+    lags = np.array([-6, 0, 6])
+    result = correlation.rolling_lag_correlation(x, y, lags, (24,))[24]
+    for i, lag in enumerate(lags):
+        expected = rolling_corr(x, y, lag, 24)
+        np.testing.assert_array_equal(np.isnan(result[i]), np.isnan(expected))
+        np.testing.assert_allclose(result[i], expected, atol=1e-5, equal_nan=True)
+
+
+def test_constant_windows_are_nan():
+    x = np.r_[np.ones(48), np.arange(48.0)]
+    y = np.arange(96.0)
+    result = correlation.rolling_lag_correlation(x, y, np.array([0]), (24,))[24][0]
+    assert np.isnan(result[:48]).all()
+    np.testing.assert_allclose(result[71:], 1.0, atol=1e-5)
@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import elhub
+
+
+class ElhubStub(BaseHTTPRequestHandler):
+    """Serves one hour of consumption per requested month, failing listed months once with a 500."""
+
+    def do_GET(self):
+        server = self.server
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        start = params["startDate"]
+        with server.lock:
+            server.requests.append(start)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            fail = start in server.fail_once
+            server.fail_once.discard(start)
+        try:
+            time.sleep(0.05)  # long enough for parallel requests to overlap
+            if fail:
+                self.send_response(500)
+                self.end_headers()
+                return
+            row = {
+                "priceArea": "NO1",
+                "consumptionGroup": "household",
+                "quantityKwh": 1.0,
+                "startTime": f"{start}T00:00:00+01:00",
+                "endTime": f"{start}T01:00:00+01:00",
+                "meteringPointCount": 1,
+                "lastUpdatedTime": f"{start}T12:00:00+01:00",
+            }
+            body = json.dumps({"data": [{"attributes": {"consumptionPerGroupMbaHour": [row]}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ElhubStub)
+    server.lock = threading.Lock()
+    server.requests, server.fail_once = [], set()
+    server.active = server.peak = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run(stub, checkpoint, max_workers=4):
+    batches = []
+    stats = elhub.ingest("consumption", 2022, 2022, batches.append, checkpoint=checkpoint,
+                         max_workers=max_workers, base_url=f"http://127.0.0.1:{stub.server_port}/")
+    return stats, [record for batch in batches for record in batch]
+
+
+def test_chunks_are_fetched_concurrently(stub, tmp_path):
+    stats, records = run(stub, tmp_path / "checkpoint.json", max_workers=4)
+    assert stats["chunks"] == 12 and not stats["failed"]
+    assert len(records) == 12
+    assert 1 < stub.peak <= 4
+
+
+def test_server_errors_are_retried(stub, tmp_path):
+    stub.fail_once.add("2022-03-01")
+    stats, records = run(stub, tmp_path / "checkpoint.json")
+    assert not stats["failed"]
+    assert stub.requests.count("2022-03-01") == 2
+    assert len(records) == 12
+
+
+def test_checkpointed_months_are_skipped(stub, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    elhub.save_checkpoint(checkpoint, {(2022, month) for month in range(1, 7)})
+
+    stats, records = run(stub, checkpoint)
+    assert stats["skipped"] == 6 and stats["chunks"] == 6
+    assert sorted(stub.requests) == [f"2022-{month:02d}-01" for month in range(7, 13)]
+    assert elhub.load_checkpoint(checkpoint) == {(2022, month) for month in range(1, 13)}
+
+
+def test_years_are_split_by_partition(monkeypatch):
+    calls = []
+    monkeypatch.setattr(elhub, "ingest_partition", lambda *args, **kwargs: calls.append(args[:4]))
+    monkeypatch.setattr("mongodb.get_collection", lambda name: name)
+
+    elhub.main(["consumption", "2021", "2024"])
+    assert calls == [("consumption", 2021, 2021, "consumption_2021"),
+                     ("consumption", 2022, 2024, "consumption_2022_2024")]
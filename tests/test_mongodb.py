@@ -0,0 +1,109 @@
+import mongomock
+import numpy as np
+import pandas as pd
+import pymongo
+import pytest
+
+import mongodb
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mongodb, "init_connection", lambda: client)
+    mongodb.collection_names.clear()
+    mongodb.load_frame.clear()
+    yield client
+    mongodb.collection_names.clear()
+    mongodb.load_frame.clear()
+
+
+@pytest.fixture
+def hourly(client):
+    """Two areas and three groups of hourly consumption, January to March 2021."""
+    rng = np.random.default_rng(10)
+    times = pd.date_range("2021-01-01", "2021-03-31 23:00", freq="h")
+    rows = pd.DataFrame(
+        [(area, group, t) for area in ("NO1", "NO2") for group in ("household", "cabin", "primary") for t in times],
+        columns=["pricearea", "consumptiongroup", "starttime"],
+    )
+    rows["quantitykwh"] = rng.integers(0, 1000, len(rows)).astype(float)
+    records = rows.assign(starttime=list(rows["starttime"].dt.to_pydatetime())).to_dict("records")
+    client[mongodb.DATABASE]["consumption_2021"].insert_many(records)
+    return rows
+
+
+def test_aggregate_hourly_matches_pandas(hourly):
+    by = ("pricearea", "consumptiongroup", "month", "hour")
+    result = mongodb.aggregate_hourly("consumption", by, "2021-01-01", "2021-04-01")
+
+    expected = (hourly.assign(month=hourly["starttime"].dt.month, hour=hourly["starttime"].dt.hour)
+                .groupby(list(by), as_index=False)["quantitykwh"].sum())
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_build_pipeline_filters(hourly, client):
+    by = ("consumptiongroup", "day")
+    pipeline = mongodb.build_pipeline(by, pricearea="NO2", groups=["cabin", "primary"], month=2)
+    result = pd.DataFrame(list(client[mongodb.DATABASE]["consumption_2021"].aggregate(pipeline)))
+
+    rows = hourly[(hourly["pricearea"] == "NO2") & hourly["consumptiongroup"].isin(["cabin", "primary"])
+                  & (hourly["starttime"].dt.month == 2)]
+    expected = (rows.assign(day=rows["starttime"].dt.day)
+                .groupby(list(by), as_index=False)["quantitykwh"].sum())
+    pd.testing.assert_frame_equal(result[[*by, "quantitykwh"]], expected, check_dtype=False)
+
+
+def test_find_hourly_range(hourly):
+    result = mongodb.find_hourly("consumption", "2021-02-01", "2021-02-08", pricearea="NO1")
+
+    rows = hourly[(hourly["pricearea"] == "NO1") & (hourly["starttime"] >= "2021-02-01")
+                  & (hourly["starttime"] < "2021-02-08")]
+    assert len(result) == len(rows)
+    assert result["quantitykwh"].sum() == rows["quantitykwh"].sum()
+    assert result["starttime"].is_monotonic_increasing
+
+
+def test_upsert_records_is_idempotent(client):
+    collection = client[mongodb.DATABASE]["consumption_2021"]
+    mongodb.ensure_unique_index(collection)
+    records = [
+        {"pricearea": "NO1", "consumptiongroup": "household", "starttime": t.to_pydatetime(), "quantitykwh": 1.0}
+        for t in pd.date_range("2021-01-01", periods=48, freq="h")
+    ]
+
+    first = mongodb.upsert_records(collection, records, batch_size=20)
+    assert (first["inserted"], first["updated"], first["skipped"]) == (48, 0, 0)
+
+    again = mongodb.upsert_records(collection, records, batch_size=20)
+    assert (again["inserted"], again["updated"], again["skipped"]) == (0, 0, 48)
+    assert collection.count_documents({}) == 48
+
+    changed = [dict(records[5], quantitykwh=2.0)]
+    stats = mongodb.upsert_records(collection, changed)
+    assert (stats["inserted"], stats["updated"], stats["skipped"]) == (0, 1, 0)
+    assert collection.count_documents({}) == 48
+    assert collection.find_one({"starttime": records[5]["starttime"]})["quantitykwh"] == 2.0
+
+    with pytest.raises(pymongo.errors.DuplicateKeyError):
+        collection.insert_one(dict(records[0]))
+
+
+@pytest.mark.parametrize("batch_size", [7, 10_000])
+def test_load_frame_grows_without_counting(hourly, client, monkeypatch, batch_size):
+    collection = client[mongodb.DATABASE]["consumption_2021"]
+    count_documents = type(collection).count_documents
+    counted = []
+    monkeypatch.setattr(type(collection), "count_documents",
+                        lambda self, filter, *args, **kwargs: counted.append(filter)
+                        or count_documents(self, filter, *args, **kwargs))
+
+    query = mongodb.range_query("2021-01-01", "2021-01-02", pricearea="NO1")
+    frame = mongodb.load_frame("consumption_2021", query=query, batch_size=batch_size)
+    assert len(frame) == 3 * 24
+    assert frame["quantitykwh"].sum() == hourly.loc[hourly["starttime"] < "2021-01-02"].query(
+        "pricearea == 'NO1'")["quantitykwh"].sum()
+
+    assert len(mongodb.load_frame("consumption_2021", batch_size=batch_size)) == len(hourly)
+    # mongomock implements estimated_document_count as an unfiltered count
+    assert all(not filter for filter in counted)
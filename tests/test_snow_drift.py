@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import Snow_drift as sd
+
+# The loop implementation the vectorized engine replaced, kept as the reference
+# the engine has to match.
+
+
+def loop_Qupot(hourly_wind_speeds, dt=3600):
+    return sum((u ** 3.8) * dt for u in hourly_wind_speeds) / 233847
+
+
+def loop_sector_index(direction):
+    return int(((direction + 11.25) % 360) // 22.5)
+
+
+def loop_sector_transport(hourly_wind_speeds, hourly_wind_dirs, dt=3600):
+    sectors = [0.0] * 16
+    for u, d in zip(hourly_wind_speeds, hourly_wind_dirs):
+        sectors[loop_sector_index(d)] += ((u ** 3.8) * dt) / 233847
+    return sectors
+
+
+def loop_yearly_results(df, T, F, theta):
+    results_list = []
+    for s in sorted(df['season'].unique()):
+        season_start = pd.Timestamp(year=s, month=7, day=1)
+        season_end = pd.Timestamp(year=s + 1, month=6, day=30, hour=23, minute=59, second=59)
+        df_season = df[(df['time'] >= season_start) & (df['time'] <= season_end)].copy()
+        if df_season.empty:
+            continue
+        df_season['Swe_hourly'] = df_season.apply(
+            lambda row: row['precipitation (mm)'] if row['temperature_2m (°C)'] < 1 else 0, axis=1)
+        total_Swe = df_season['Swe_hourly'].sum()
+        wind_speeds = df_season["wind_speed_10m (m/s)"].tolist()
+        Qupot = loop_Qupot(wind_speeds)
+        Qspot = 0.5 * T * total_Swe
+        Srwe = theta * total_Swe
+        Qinf = 0.5 * T * Srwe if Qupot > Qspot else Qupot
+        results_list.append({
+            "Qupot (kg/m)": Qupot,
+            "Qspot (kg/m)": Qspot,
+            "Srwe (mm)": Srwe,
+            "Qinf (kg/m)": Qinf,
+            "Qt (kg/m)": Qinf * (1 - 0.14 ** (F / T)),
+            "Control": "Snowfall controlled" if Qupot > Qspot else "Wind controlled",
+            "season": f"{s}-{s+1}",
+        })
+    return pd.DataFrame(results_list)
+
+
+def loop_average_sector(df):
+    sectors_list = []
+    for _, group in df.groupby('season'):
+        sectors_list.append(loop_sector_transport(
+            group["wind_speed_10m (m/s)"].tolist(), group["wind_direction_10m (°)"].tolist()))
+    return np.mean(sectors_list, axis=0)
+
+
+@pytest.fixture
+def hourly():
+    """Three seasons of synthetic hourly weather, from July 2019 to June 2022."""
+    rng = np.random.default_rng(320)
+    time = pd.date_range("2019-07-01", "2022-06-30 23:00", freq="h")
+    df = pd.DataFrame({
+        "time": time,
+        "temperature_2m (°C)": rng.normal(0, 8, len(time)),
+        "precipitation (mm)": rng.exponential(0.3, len(time)) * (rng.random(len(time)) < 0.4),
+        "wind_speed_10m (m/s)": rng.weibull(2, len(time)) * 7,
+        "wind_direction_10m (°)": rng.uniform(0, 360, len(time)),
+    })
+    return sd.assign_season(df)
+
+
+@pytest.mark.parametrize("T, F, theta", [(3000, 30000, 0.5), (500, 2000, 0.2), (10000, 5000, 0.9)])
+def test_yearly_results_match_loop(hourly, T, F, theta):
+    pd.testing.assert_frame_equal(
+        sd.compute_yearly_results(hourly, T, F, theta),
+        loop_yearly_results(hourly, T, F, theta),
+        check_exact=False, rtol=1e-10,
+    )
+
+
+def test_average_sector_matches_loop(hourly):
+    np.testing.assert_allclose(sd.compute_average_sector(hourly), loop_average_sector(hourly), rtol=1e-10)
+
+
+def test_sector_directions_on_bin_edges(hourly):
+    # Directions exactly on a sector boundary, and 360° wrapping to north
+    hourly["wind_direction_10m (°)"] = np.resize([0.0, 11.25, 348.75, 360.0, 191.25], len(hourly))
+    np.testing.assert_allclose(sd.compute_average_sector(hourly), loop_average_sector(hourly), rtol=1e-10)
+
+
+def test_missing_precipitation_is_skipped(hourly):
+    cold = hourly.index[hourly["temperature_2m (°C)"] < 1]
+    hourly.loc[cold[::50], "precipitation (mm)"] = np.nan
+
+    yearly = sd.compute_yearly_results(hourly, 3000, 30000, 0.5)
+    assert yearly["Qt (kg/m)"].notna().all()
+    pd.testing.assert_frame_equal(
+        yearly, loop_yearly_results(hourly, 3000, 30000, 0.5), check_exact=False, rtol=1e-10,
+    )
+
+
+def test_batch_results_from_threaded_downloads(hourly):
+    # The process pool starts while the download threads are running
+    sites = [(60.0, 10.0), (61.0, 11.0), (60.0, 10.0)]
+    frame = hourly.drop(columns="season")
+    results = sd.compute_batch_results(sites, "2019-07-01", "2022-06-30",
+                                       loader=lambda lat, lon, start, end: frame, max_workers=2)
+    assert not results.attrs["skipped"]
+    assert list(results.drop_duplicates(["lat", "lon"])[["lat", "lon"]].itertuples(index=False, name=None)) \
+        == sites[:2]
+    expected = sd.site_results(frame, 60.0, 10.0)
+    pd.testing.assert_frame_equal(results[results["lat"] == 60.0].reset_index(drop=True), expected)
@@ -1,68 +1,113 @@
-import openmeteo_requests
-import requests_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 
-from retry_requests import retry
 from scipy.fftpack import dct, idct
 from statsmodels.tsa.seasonal import STL
 from sklearn.neighbors import LocalOutlierFactor
 from scipy.signal import spectrogram
 
-# Setup the Open-Meteo API client with cache and retry on error
-cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
-retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
-openmeteo = openmeteo_requests.Client(session = retry_session)
+from weather_schema import compact_weather
+from weather_store import get_hourly, plan_fetch, merge_hourly
+
+# Column names used by the Snow_drift module and the map/forecast pages
+METEO_COLUMNS = {
+    "temperature_2m": "temperature_2m (°C)",
+    "precipitation": "precipitation (mm)",
+    "wind_speed_10m": "wind_speed_10m (m/s)",
+    "wind_gusts_10m": "wind_gusts_10m (m/s)",
+    "wind_direction_10m": "wind_direction_10m (°)"
+}
 
 def save_data(latitude: float, longitude: float, year) -> pd.DataFrame:
     # Make sure all required weather variables are listed here
-    # The order of variables in hourly or daily is important to assign them correctly below
-    """ Change the url to fetch the data we need"""
-    url = "https://archive-api.open-meteo.com/v1/era5"
-    params = {
-        "latitude": latitude,
-        "longitude": longitude,
-        "hourly": [
-            "temperature_2m",
-            "precipitation",
-            "wind_speed_10m",
-            "wind_gusts_10m",
-            "wind_direction_10m"
-        ],
-        "models": "era5",
-        "start_date": f"{year}-01-01",
-        "end_date": f"{year}-12-31",
-    }
-    responses = openmeteo.weather_api(url, params=params)
-
-    # Process first location. Add a for-loop for multiple locations or weather models
-    response = responses[0]
-    print(f"Coordinates: {response.Latitude()}°N {response.Longitude()}°E")
-    print(f"Elevation: {response.Elevation()} m asl")
-    print(f"Timezone difference to GMT+0: {response.UtcOffsetSeconds()}s")
-
-    # Process hourly data. The order of variables needs to be the same as requested.
-    hourly = response.Hourly()
-    hourly_temperature_2m = hourly.Variables(0).ValuesAsNumpy()
-    hourly_precipication = hourly.Variables(1).ValuesAsNumpy()
-    hourly_wind_speed_10m = hourly.Variables(2).ValuesAsNumpy()
-    hourly_wind_gusts_10m = hourly.Variables(3).ValuesAsNumpy()
-    hourly_wind_direction_10m = hourly.Variables(4).ValuesAsNumpy()
-
-    hourly_data = {"date": pd.date_range(
-        start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
-        end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
-        freq=pd.Timedelta(seconds=hourly.Interval()),
-        inclusive="left"
-    ), "temperature_2m": hourly_temperature_2m, "precipication": hourly_precipication,
-        "wind_speed_10m": hourly_wind_speed_10m, "wind_gusts_10m": hourly_wind_gusts_10m,
-        "wind_direction_10m": hourly_wind_direction_10m}
-
-    hourly_dataframe = pd.DataFrame(data = hourly_data)
-
-    return hourly_dataframe
+    """ Change the variables to fetch the data we need"""
+    variables = [
+        "temperature_2m",
+        "precipitation",
+        "wind_speed_10m",
+        "wind_gusts_10m",
+        "wind_direction_10m"
+    ]
+    # Served from the shared weather store, only missing days are downloaded
+    df = get_hourly(latitude, longitude, f"{year}-01-01", f"{year}-12-31", variables)
+
+    hourly_dataframe = df.rename(columns={"time": "date", "precipitation": "precipication"})
+    hourly_dataframe["date"] = hourly_dataframe["date"].dt.tz_localize("UTC")
+
+    return compact_weather(hourly_dataframe)
+
+def save_data_bulk(locations, years, max_workers=4, progress=None) -> pd.DataFrame:
+    """
+    Fetch several locations and years concurrently with a bounded thread pool.
+
+    locations: dict of name -> (latitude, longitude), or a list of (latitude, longitude)
+    years: list of years
+    progress: optional callback(done, total) called after every location-year
+
+    Returns one long-format frame with 'location', 'latitude' and 'longitude'
+    columns in front of the save_data columns.
+    """
+    if isinstance(locations, dict):
+        items = list(locations.items())
+    else:
+        items = [(f"{lat:.2f}N {lon:.2f}E", (lat, lon)) for lat, lon in locations]
+
+    def load(name, lat, lon, year):
+        df = save_data(lat, lon, year)
+        df.insert(0, "longitude", lon)
+        df.insert(0, "latitude", lat)
+        df.insert(0, "location", name)
+        return df
+
+    # max_workers bounds the number of simultaneous requests to Open-Meteo.
+    # Tasks are submitted year-major, so concurrent tasks hit different points
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            (name, year): executor.submit(load, name, lat, lon, year)
+            for year in years
+            for name, (lat, lon) in items
+        }
+        for done, _ in enumerate(as_completed(futures.values()), start=1):
+            if progress is not None:
+                progress(done, len(futures))
+
+    # Keep the order of the input locations and years
+    frames = [futures[(name, year)].result() for name, _ in items for year in years]
+    return compact_weather(pd.concat(frames, ignore_index=True))
+
+def fetch_meteo(lat, lon, start_date, end_date, variables=None):
+    """
+    Fetch hourly ERA5 data for one coordinate from the shared weather store,
+    with columns named the way the Snow_drift module expects them.
+    """
+    if variables is None:
+        variables = ["temperature_2m", "precipitation", "wind_speed_10m", "wind_direction_10m"]
+
+    df = get_hourly(lat, lon, start_date, end_date, variables)
+
+    # Only rename if columns exist (prevents KeyError)
+    df = df.rename(columns={k: v for k, v in METEO_COLUMNS.items() if k in df.columns})
+
+    return compact_weather(df)
+
+def extend_meteo(df, lat, lon, start_date, end_date, variables=None):
+    """
+    Make sure an hourly meteo frame (with a 'time' column) covers
+    [start_date, end_date]. Only the missing sub-ranges are fetched, then
+    everything is merged into one sorted frame without duplicates.
+    """
+    if df is None or "time" not in df.columns:
+        return fetch_meteo(lat, lon, start_date, end_date, variables)
+
+    parts = [df]
+    for gap_start, gap_end in plan_fetch(df["time"], start_date, end_date):
+        parts.append(fetch_meteo(lat, lon, gap_start, gap_end, variables))
+    if len(parts) == 1:
+        return df
+    return merge_hourly(parts)
 
 # Temperature Outlier Detection
 def detect_temperature_outliers(df, temp_col='temperature_2m', cutoff=100, std_mult=2):
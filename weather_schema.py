@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+# Shared dtype schema for hourly weather frames. Several of these frames are
+# kept in st.session_state per user, so they are stored as compactly as possible:
+#  - measurements as float32
+#  - wind direction (whole degrees) as uint16
+#  - season and location labels as categoricals
+#  - no string copy of the time column
+
+CATEGORICAL_COLUMNS = ["season", "location", "area", "group"]
+
+
+def is_direction_column(col: str) -> bool:
+    return col.startswith("wind_direction")
+
+
+def memory_usage(df: pd.DataFrame) -> int:
+    """Total memory of a frame in bytes, including object/string contents."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def compact_weather(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Downcast a weather frame to the compact schema. The memory before and
+    after is reported in df.attrs["memory_before_bytes"] and
+    df.attrs["memory_after_bytes"]. Compacting a frame again keeps the
+    original "before", so the report always covers the whole saving.
+    """
+    before = df.attrs.get("memory_before_bytes", memory_usage(df))
+    df = df.drop(columns=["time_str"], errors="ignore")
+
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if is_direction_column(col) and pd.api.types.is_numeric_dtype(values) and not values.hasnans:
+            columns[col] = (np.round(values.to_numpy()) % 360).astype(np.uint16)
+        elif pd.api.types.is_float_dtype(values):
+            columns[col] = values.astype(np.float32)
+        elif col in CATEGORICAL_COLUMNS:
+            columns[col] = values.astype("category")
+    if columns:
+        df = df.assign(**columns)
+
+    df.attrs["memory_before_bytes"] = before
+    df.attrs["memory_after_bytes"] = memory_usage(df)
+    return df
+
+
+def memory_saved(df: pd.DataFrame) -> str:
+    """Human readable summary of the memory saved by compact_weather."""
+    before = df.attrs.get("memory_before_bytes")
+    after = df.attrs.get("memory_after_bytes")
+    if before is None or after is None:
+        return "No memory report available"
+    saved = before - after
+    return f"{after / 1e6:.2f} MB (saved {saved / 1e6:.2f} MB, {saved / max(before, 1):.0%})"
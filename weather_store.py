@@ -0,0 +1,224 @@
+import os
+import json
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import openmeteo_requests
+import requests
+
+from retry_requests import retry
+
+# Shared, persistent store for hourly ERA5 data from Open-Meteo.
+# Data is kept per (point, variable) as a Parquet file and only the
+# date ranges that are not already on disk are requested from the API.
+
+ERA5_URL = "https://archive-api.open-meteo.com/v1/era5"
+STORE_DIR = Path(__file__).parent / "data" / "weather_store"
+
+# Open-Meteo corrects the ERA5 temperature to the elevation of the exact point
+# requested (from a 90 m DEM), so two points in the same 0.25° ERA5 cell do not
+# get the same data. Points are keyed at POINT_DECIMALS decimals, about 11 m,
+# far below the DEM resolution: the data equals that of the exact coordinate,
+# at the cost of only sharing the store between (nearly) identical coordinates
+# such as repeated clicks, saved sites and batch rasters.
+POINT_DECIMALS = 4
+
+# ERA5 data is preliminary (ERA5T) for the last few days, so those days are
+# served but never persisted
+FINAL_LAG_DAYS = 7
+
+# One lock per point, so concurrent requests never rewrite the same file at once
+_point_locks = defaultdict(threading.Lock)
+
+retry_session = retry(requests.Session(), retries=5, backoff_factor=0.2)
+openmeteo = openmeteo_requests.Client(session=retry_session)
+
+
+def store_point(lat: float, lon: float) -> tuple:
+    """The coordinate a point is requested and stored as (see POINT_DECIMALS)."""
+    return round(float(lat), POINT_DECIMALS), round(float(lon), POINT_DECIMALS)
+
+
+def _point_dir(point: tuple) -> Path:
+    return STORE_DIR / f"{point[0]:.{POINT_DECIMALS}f}_{point[1]:.{POINT_DECIMALS}f}"
+
+
+def _point_path(point: tuple, variable: str) -> Path:
+    return _point_dir(point) / f"{variable}.parquet"
+
+
+def load_variable(point: tuple, variable: str) -> pd.Series:
+    """Load the stored hourly series for one point and variable."""
+    path = _point_path(point, variable)
+    if not path.exists():
+        return pd.Series(dtype="float32", index=pd.DatetimeIndex([], name="time"), name=variable)
+    return pd.read_parquet(path)["value"].rename(variable)
+
+
+def save_variable(point: tuple, series: pd.Series):
+    """Persist an hourly series, writing through a temporary file so readers never see partial data."""
+    path = _point_path(point, series.name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    series.rename("value").to_frame().to_parquet(tmp)
+    os.replace(tmp, path)
+
+
+def load_metadata(point: tuple) -> dict:
+    """Load the stored location metadata (elevation, UTC offset, ...) of a point."""
+    path = _point_dir(point) / "metadata.json"
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save_metadata(point: tuple, metadata: dict):
+    path = _point_dir(point) / "metadata.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(metadata))
+
+
+def plan_fetch(held, start, end) -> list:
+    """
+    Compare the requested days [start, end] with the hours already held
+    (in memory or on disk) and return the minimal list of contiguous
+    (start_day, end_day) ranges that still have to be fetched.
+    """
+    days = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq="D")
+    held_days = pd.DatetimeIndex(held).normalize().unique()
+    missing = days.difference(held_days)
+    if missing.empty:
+        return []
+
+    # Split the missing days into runs of consecutive days
+    breaks = np.flatnonzero(np.diff(missing.values) != np.timedelta64(1, "D")) + 1
+    return [(run[0], run[-1]) for run in np.split(missing, breaks)]
+
+
+def merge_hourly(frames: list, time_col: str = "time") -> pd.DataFrame:
+    """Merge hourly frames into one sorted frame without duplicate timestamps."""
+    df = pd.concat([f for f in frames if f is not None and not f.empty], ignore_index=True)
+    df = df.drop_duplicates(subset=time_col, keep="last").sort_values(time_col)
+    return df.reset_index(drop=True)
+
+
+@lru_cache(maxsize=64)
+def time_index(start: int, end: int, interval: int) -> pd.DatetimeIndex:
+    """Build the UTC time axis of a response once per (start, end, interval) and share it."""
+    return pd.date_range(
+        start=pd.to_datetime(start, unit="s"),
+        end=pd.to_datetime(end, unit="s"),
+        freq=pd.Timedelta(seconds=interval),
+        inclusive="left",
+        name="time",
+    )
+
+
+def response_metadata(response) -> dict:
+    """Location metadata of an Open-Meteo response."""
+    return {
+        "latitude": response.Latitude(),
+        "longitude": response.Longitude(),
+        "elevation": response.Elevation(),
+        "utc_offset_seconds": response.UtcOffsetSeconds(),
+    }
+
+
+def decode_response(response, variables: list, section: str = "hourly") -> pd.DataFrame:
+    """
+    Decode the hourly or daily block of an Open-Meteo FlatBuffers response
+    into a frame with one float32 column per variable (in request order).
+
+    The columns are views on the response buffer and are not copied. The
+    location metadata is returned in df.attrs.
+    """
+    block = response.Hourly() if section == "hourly" else response.Daily()
+    index = time_index(block.Time(), block.TimeEnd(), block.Interval())
+    data = {
+        var: block.Variables(i).ValuesAsNumpy().astype(np.float32, copy=False)
+        for i, var in enumerate(variables)
+    }
+    df = pd.DataFrame(data, index=index, copy=False)
+    df.attrs.update(response_metadata(response))
+    return df
+
+
+def fetch_hourly(lat: float, lon: float, start_date, end_date, variables: list) -> pd.DataFrame:
+    """Download hourly ERA5 data from Open-Meteo. Returns a frame indexed by UTC time."""
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "hourly": variables,
+        "models": "era5",
+        "start_date": pd.Timestamp(start_date).strftime("%Y-%m-%d"),
+        "end_date": pd.Timestamp(end_date).strftime("%Y-%m-%d"),
+    }
+    response = openmeteo.weather_api(ERA5_URL, params=params)[0]
+    return decode_response(response, variables)
+
+
+def get_hourly(lat: float, lon: float, start_date, end_date, variables: list) -> pd.DataFrame:
+    """
+    Return hourly data for [start_date, end_date] (inclusive days) with a
+    'time' column (UTC) and one column per variable.
+
+    Only ranges that are missing from the store are downloaded. Repeated
+    requests are served from disk without a network round-trip.
+
+    The data is that of the requested coordinate (to POINT_DECIMALS), not of
+    the centre of its ERA5 cell, so the elevation correction of the
+    temperature matches the point. The point lock is only held while the
+    store is read and written, never during a download.
+    """
+    point = store_point(lat, lon)
+    start = pd.Timestamp(start_date).normalize()
+    end = pd.Timestamp(end_date).normalize()
+    final_until = pd.Timestamp.today().normalize() - pd.Timedelta(days=FINAL_LAG_DAYS)
+
+    with _point_locks[point]:
+        stored = {var: load_variable(point, var) for var in variables}
+        metadata = load_metadata(point)
+
+    # Group variables that are missing the same date range into one request
+    requests_needed = {}
+    for var, series in stored.items():
+        for gap in plan_fetch(series.index, start, end):
+            requests_needed.setdefault(gap, []).append(var)
+
+    fetched = [
+        (fetch_hourly(point[0], point[1], gap_start, gap_end, gap_vars), gap_vars)
+        for (gap_start, gap_end), gap_vars in requests_needed.items()
+    ]
+
+    recent = []
+    if fetched:
+        with _point_locks[point]:
+            # Reload, another request may have written the point meanwhile
+            stored = {var: load_variable(point, var) for var in variables}
+            metadata = load_metadata(point)
+            for part, gap_vars in fetched:
+                if part.attrs and not metadata:
+                    metadata = dict(part.attrs)
+                    save_metadata(point, metadata)
+                is_final = part.index < final_until + pd.Timedelta(days=1)
+                for var in gap_vars:
+                    final_part = part.loc[is_final, var]
+                    if not final_part.empty:
+                        merged = pd.concat([stored[var], final_part]).sort_index()
+                        stored[var] = merged[~merged.index.duplicated(keep="last")]
+                        save_variable(point, stored[var])
+                if not is_final.all():
+                    recent.append(part.loc[~is_final])
+
+    df = pd.DataFrame({var: series.loc[start:end + pd.Timedelta(hours=23)] for var, series in stored.items()})
+    for part in recent:
+        df = df.combine_first(part[[c for c in part.columns if c in df.columns]])
+    df = df.loc[start:end + pd.Timedelta(hours=23), variables]
+    df.index.name = "time"
+    df = df.reset_index()
+    df.attrs.update(metadata)
+    return df